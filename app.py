@@ -2,29 +2,59 @@ import streamlit as st
 import streamlit.components.v1 as components
 from streamlit_extras.stylable_container import stylable_container
 import calendar
+import hashlib
+import threading
+from collections import OrderedDict
 import pandas as pd
 import altair as alt
 import datetime  
-import requests
-import pandas as pd
 import folium
 from folium import IFrame
 from folium.plugins import  MarkerCluster, HeatMap
+from streamlit_folium import st_folium
 from db_utils import (
-    get_conn,
-    get_map_data,
+    get_ticket_sync,
     load_cctv_df,
     get_dashboard_overview,
     get_bma_news,
     get_bma_events,
-    get_type_summary,
     get_ticket,
-    get_district_summary,
     get_police_stations,
     get_bangkok_population,
+    get_status_time_series,
+    LazyQuery,
+    iter_map_data,
+    table_version,
 )
 
-from model_api import predict_time
+from model_api import predict_tickets
+from ticket_utils import (
+    BASE_CATEGORIES,
+    TIME_BUCKETS,
+    x_label_keys,
+    count_by_bucket,
+    status_plot_frame,
+    melt_status_plot,
+    classify_types,
+    facet_mask,
+    TicketCube,
+)
+from map_utils import (
+    BANGKOK_BOUNDS,
+    in_bounds,
+    viewport_rows,
+    nearest_row,
+    canvas_points,
+    build_cluster_index,
+    points_digest,
+    clusters_at,
+    cluster_marker,
+    build_heat_grids,
+    heat_at,
+    district_geojson,
+    choropleth_geojson,
+    GroupedHeatGrids,
+)
 
 MAPBOX_API_KEY = st.secrets["MAPBOX_API_KEY"]
 PG_HOST = st.secrets.get("PG_HOST", "localhost")
@@ -35,39 +65,21 @@ PG_PASS = st.secrets.get("PG_PASS")
 PG_SSL  = st.secrets.get("PG_SSLMODE")  
 SNAPSHOT_BASE = st.secrets.get("SNAPSHOT_BASE", "http://127.0.0.1:9000/snapshot")
 
-def get_district_summary_from_df(df_filtered):
-    """
-    Build district summary using the already-filtered DataFrame (df_filtered).
-    Returns a list of dicts per district.
-    """
-
-    if df_filtered.empty:
-        return []
-
-    district_groups = df_filtered.groupby("district")
-
-    summary = []
+# max ticket markers embedded per view in "แสดงเฉพาะพื้นที่บนแผนที่" mode
+VIEWPORT_MAX_MARKERS = 1500
+MAP_HTML_CACHE_SIZE = 16
 
-    for district, group in district_groups:
-        total = len(group)
-        finished = (group["state"] == "เสร็จสิ้น").sum()
-
-        # average duration from column duration_minutes_finished
-        if "duration_minutes_finished" in group.columns:
-            avg_duration = group.loc[group["duration_minutes_finished"] > 0, "duration_minutes_finished"].mean()
-        else:
-            avg_duration = None
-
-        summary.append({
-            "district": district,
-            "total": total,
-            "finished": finished,
-            "avg_duration": float(avg_duration) if avg_duration else 0,
-            "completion_rate": round((finished / total) * 100, 2) if total > 0 else 0
-        })
-
-    return summary
+status_color_map = {
+    "เสร็จสิ้น": "#66BB6A",
+    "กำลังดำเนินการ": "#FFCA28",
+    "รอรับเรื่อง": "#EF5350"
+}
 
+text_color_map = {
+    "เสร็จสิ้น": "#49a54e",
+    "กำลังดำเนินการ": "#aa8000",
+    "รอรับเรื่อง": "#ed3c39"
+}
 
 def normalize(x):
     if not isinstance(x, str):
@@ -104,15 +116,17 @@ def convert_thai_datetime(s):
     dt_str = f"{day}/{month}/{year_ad} {hour}:{minute}"
     return pd.to_datetime(dt_str, format="%d/%m/%Y %H:%M", errors='coerce')
 
-def compute_predicted_fmt(row):
-    if row['state'] != "เสร็จสิ้น":
-        predicted = predict_time(
-            row['comment'], row.get("type", ""), row['organization'],
-            row['district'], row['subdistrict'], row.get("timestamp")
-        )
+def compute_predicted_fmt(df):
+    unfinished = df[df['state'] != "เสร็จสิ้น"]
+    predictions = predict_tickets(unfinished) if not unfinished.empty else {}
+
+    def fmt(ticket_id):
+        predicted = predictions.get(ticket_id)
         if predicted:
             return format_predicted_time(predicted['predicted_hours'])
-    return "-"
+        return "-"
+
+    return df['ticket_id'].map(fmt)
 
 def format_predicted_time(hours_float):
     if hours_float is None:
@@ -139,52 +153,6 @@ def safe_convert(event):
         ts = pd.to_datetime(start_date)
     return ts
 
-def value_to_color(val, min_val, max_val, type='time'):
-    if max_val == min_val:
-        norm = 0
-    else:
-        norm = (val - min_val) / (max_val - min_val)
-
-    gradient_time = [
-        (111,156,61),
-        (165,201,15),
-        (255,179,102),
-        (255,136,41),
-        (254,107,64)
-    ]
-
-    gradient_complete = [
-        (254,107,64),
-        (255,136,41),
-        (255,179,102),
-        (165,201,15),
-        (111,156,61),
-    ]
-
-    gradient_map = {
-        "time": gradient_time,
-        "complete": gradient_complete
-    }
-
-    gradient = gradient_map.get(type, gradient_time)
-
-    total_steps = 50
-    step = int(norm * (total_steps - 1))
-
-    seg = len(gradient) - 1
-    seg_length = total_steps / seg
-    seg_index = int(step // seg_length)
-    seg_pos = (step % seg_length) / seg_length
-
-    r1, g1, b1 = gradient[seg_index]
-    r2, g2, b2 = gradient[min(seg_index + 1, seg)]
-
-    r = int(r1 + (r2 - r1) * seg_pos)
-    g = int(g1 + (g2 - g1) * seg_pos)
-    b = int(b1 + (b2 - b1) * seg_pos)
-
-    return f"rgba({r},{g},{b},0.7)"
-
 def format_duration(minutes):
     import math
 
@@ -206,6 +174,299 @@ def format_duration(minutes):
 
     return result.strip()
 
+def ticket_detail_row(row):
+    """
+    Slim map row + the text columns from get_ticket (cached per ticket_id).
+    """
+    details = get_ticket(row["ticket_id"]) or {}
+    row = row.copy()
+    for key in ("comment", "organization", "subdistrict", "organization_action", "photo"):
+        row[key] = details.get(key)
+    row["duration_minutes_total"] = details.get("duration_total")
+    return row
+
+def ticket_popup_html(row):
+    state = row["state"]
+    color = status_color_map.get(state, "#999999")
+    text_color = text_color_map.get(state, "#777777")
+    predicted_fmt = row.get("predicted_fmt", "-")
+    subdistrict = row.get("subdistrict", "")
+    district = row.get("district", "")
+    comment = row.get("comment", "")
+    organization = row.get("organization", "")
+    organization_action = row.get("organization_action", "")
+    photo_url = row.get("photo") or "https://via.placeholder.com/300x200?text=No+Image"
+    raw_ts = row.get("timestamp")
+    try:
+        ts_format = pd.to_datetime(raw_ts).strftime("%d/%m/%Y %H:%M")
+    except:
+        ts_format = raw_ts
+
+    state_badge = f"""
+        <span style="
+            border: 1px solid {color};
+            background-color: {color}4D; 
+            color: {text_color};
+            font-weight: 700;
+            padding: 2px 8px;
+            border-radius: 16px;
+            font-size: 11px;
+            display: inline-block;
+        ">{state}</span>
+    """
+
+    bottom_box_html = f"""
+    <div style="
+        padding: 6px 10px;
+        margin-top: 6px;
+        background-color: {color}33;
+        border: 1px solid {color};
+        border-radius: 8px;
+        font-size: 14px;
+    ">
+        <span style="display:block; margin-bottom:4px; font-size:11px; color:#888;">
+            {"เวลาในการดำเนินการ" if state=="เสร็จสิ้น" else "ประมาณการเวลาดำเนินการแก้ไข"}
+        </span>
+        <span style="display:block; color:{text_color}; font-weight:700; margin-bottom:2px;">
+            {format_duration(row['duration_minutes_total']) if state=="เสร็จสิ้น" else predicted_fmt}
+        </span>
+    </div>
+    """
+
+    popup_html = f"""
+    <div style="font-family:'Sarabun', sans-serif; font-size:14px; line-height:1.3; width:100%; height:100%; display:flex; flex-direction:column; border-radius:8px;">
+        <div style="overflow-y:auto; flex:1; padding:6px 10px; background-color:white; color:#6c6c6c;">
+            <div style="display:flex; justify-content:space-between; align-items:center; margin-bottom:8px;">
+                <div>{state_badge}</div>
+                <div style="font-size:11px;"><b>แจ้งเมื่อ</b> {ts_format}</div>
+            </div>
+            <img src="{photo_url}" width="100%" style="border-radius:10px;">
+            <div style="margin:8px 0;">{district} {subdistrict}</div>
+            <div style="margin-bottom:6px;"><b>ปัญหา:</b> {comment}</div>
+            <div style="margin-bottom:6px;"><b>หน่วยงานที่รับเรื่อง:</b> {organization}</div>
+            <div><b>การดำเนินการ:</b> {organization_action}</div> 
+            
+        </div>
+        {bottom_box_html}
+    </div>
+    """
+
+    return popup_html
+
+
+def ticket_marker(row):
+    color = status_color_map.get(row["state"], "#999999")
+    return folium.CircleMarker(
+        location=[row["lat"], row["lng"]],
+        radius=8,
+        color=color,
+        fill=True,
+        fill_color=color,
+        fill_opacity=0.7
+    )
+
+def news_marker(news):
+    icon = folium.CustomIcon(
+        icon_image="https://img.icons8.com/?size=100&id=VzgzXxIQUeYS&format=png&color=AF94D9",
+        icon_size=(36, 36), 
+    )
+
+    return folium.Marker(
+        location=[news['lat'], news['lng']],
+        icon=icon,
+        popup=folium.Popup(
+            html=f"""
+            <div style="
+                font-family: 'Sarabun', sans-serif;
+                font-size: 14px;
+                line-height: 1.4;
+                padding: 8px 12px;
+                color: #AF94D9;
+                background-color: #FFFFFF;
+                border-radius: 8px;
+                max-height: 250px;
+                overflow-y: auto;
+                width: 250px;
+            ">
+                <b>ข่าว:</b> {news['title']}<br>
+                <b>วันที่:</b> {news['news_date']}<br>
+                <b>รายละเอียด:</b> {news['description']}<br>
+                <b>แหล่งที่มา:</b> {news['source']}
+            </div>
+            """,
+            max_width=350
+        )
+    )
+
+def police_marker(station):
+    return folium.Marker(
+        location=[station['lat'], station['lng']],
+        icon=folium.DivIcon(
+            html="""
+            <div style="
+                background-color:#A06CD5;
+                width:18px;
+                height:18px;
+                border-radius:50%;
+                border:2px solid white;
+                box-shadow: 0 0 3px rgba(0,0,0,0.5);
+            "></div>
+            """
+        ),
+        popup=folium.Popup(
+            html=f"""
+            <div style="
+                font-family: 'Sarabun', sans-serif;
+                font-size: 14px;
+                color: #777777;
+                background-color: #FFFFFF;
+                border-radius: 8px;
+                width: 230px;
+                display: flex;
+                flex-direction: column;
+                max-height: 250px;
+            ">
+                <div style="overflow-y: auto; flex: 1; padding: 6px 10px;">
+                    <b>สถานีตำรวจ</b><br> {station['name']}<br><br>
+                    <b>แผนก</b><br> {station['division']}<br><br>
+                    <b>ที่อยู่</b><br> {station['address']}
+                </div>
+                <div style="padding: 6px 10px; border-top: 1px solid #eee; display:flex; align-items:center; gap:6px;">
+                    <img src="https://img.icons8.com/?size=100&id=ufkkYBXJSuPy&format=png&color=000000" 
+                        width="20" height="20" style="vertical-align:middle;">
+                    <span>{station['tel']}</span>
+                </div>
+            </div>
+            """,
+            max_width=350
+        )
+    )
+
+def cctv_marker(row):
+    icon = folium.CustomIcon(
+        icon_image="https://img.icons8.com/?size=100&id=PctCctSTsD41&format=png&color=AF94D9",
+        icon_size=(28, 28)
+    )
+
+    snapshot_url = f"{SNAPSHOT_BASE}/{row['id']}"
+
+    popup_html = f"""
+    <div style="
+        font-family: 'Sarabun', sans-serif;
+        font-size: 14px;
+        line-height: 1.2;
+        padding: 4px 4px;
+        background-color: white;
+        color: #AF94D9;
+        border-radius: 8px;
+        text-align: left;
+    ">
+        <b style='display:block; margin-bottom:6px;'>{row['name']}</b>
+        <span style='display:block; margin-bottom:4px;'>ตำแหน่ง: {row['lat']}, {row['lng']}</span>
+        
+        <div style="margin-top:8px; text-align:center;">
+            <img id="cctv_img_{row['id']}" 
+                 src="{snapshot_url}?t={pd.Timestamp.now().timestamp()}" 
+                 width="100%" 
+                 height="180px"
+                 style="border-radius:12px;"
+                 onerror="this.src='https://via.placeholder.com/200x120?text=Offline';">
+        </div>
+    </div>
+
+    <script>
+        var img = document.getElementById("cctv_img_{row['id']}");
+        setInterval(function(){{
+            img.src = "{snapshot_url}?t=" + new Date().getTime();
+        }}, 1000);
+    </script>
+    """
+
+    iframe = IFrame(html=popup_html, width=280, height=260)
+    return folium.Marker(
+        location=[row["lat"], row["lng"]],
+        icon=icon,
+        popup=folium.Popup(iframe, max_width=280)
+    )
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def cached_cluster_index(layer, signature, digest, _lats, _lngs):
+    return build_cluster_index(_lats, _lngs)
+
+def add_clustered(group, layer, signature, df, single_marker, color, zoom, bounds):
+    """
+    Add df's clusters for the map zoom and bounds to group.
+    The cluster index is cached per (layer, signature) and digest of df's
+    coordinates, so its row positions always index the df being drawn.
+    single_marker(i) builds the regular marker for row position i.
+    Returns: List of the row positions drawn as single markers
+    """
+    lats, lngs = df["lat"].to_numpy(), df["lng"].to_numpy()
+    index = cached_cluster_index(layer, signature, points_digest(lats, lngs), lats, lngs)
+    clusters = clusters_at(index, zoom)
+    clusters = clusters[in_bounds(clusters, bounds)]
+    singles = []
+    for c in clusters.itertuples(index=False):
+        if c.n_points == 1:
+            singles.append(int(c.point))
+            single_marker(int(c.point)).add_to(group)
+        else:
+            cluster_marker(c.lat, c.lng, c.n_points, color).add_to(group)
+    return singles
+
+def cached_layer(name, signature, build):
+    """
+    FeatureGroup for a static map layer, rebuilt by build(group) only when its
+    signature changes. Kept per session since folium elements are re-parented
+    onto each new map.
+    """
+    layers = st.session_state.setdefault("map_layers", {})
+    cached = layers.get(name)
+    if cached is None or cached[0] != signature:
+        group = folium.FeatureGroup(name=name)
+        build(group)
+        cached = layers[name] = (signature, group)
+    return cached[1]
+
+@st.cache_resource
+def get_map_html_cache():
+    """
+    Process-wide LRU: hash(map signature) -> rendered map HTML.
+    """
+    return {"lock": threading.Lock(), "html": OrderedDict()}
+
+def cached_map_html(signature, build_map):
+    key = hashlib.sha1(repr(signature).encode("utf-8")).hexdigest()
+    cache = get_map_html_cache()
+    with cache["lock"]:
+        html = cache["html"].get(key)
+        if html is not None:
+            cache["html"].move_to_end(key)
+            return html
+
+    html = build_map().get_root().render()
+    with cache["lock"]:
+        cache["html"][key] = html
+        while len(cache["html"]) > MAP_HTML_CACHE_SIZE:
+            cache["html"].popitem(last=False)
+    return html
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def cached_heat_grids(layer, signature, digest, _lats, _lngs):
+    return build_heat_grids(_lats, _lngs)
+
+def add_heatmap(group, layer, signature, lats, lngs, zoom, bounds, grids=None):
+    """
+    Add a HeatMap of pre-binned grid cells for the map zoom and bounds to group,
+    so the payload is bounded by the grid size rather than the point count.
+    Pass grids when they are already aggregated (e.g. streamed); otherwise
+    they are cached per (layer, signature) and digest of the points.
+    """
+    if grids is None:
+        grids = cached_heat_grids(layer, signature, points_digest(lats, lngs), lats, lngs)
+    cells = heat_at(grids, zoom)
+    cells = cells[in_bounds(cells, bounds)]
+    HeatMap(cells[["lat", "lng", "weight"]].values.tolist(), radius=30, min_opacity=0.1).add_to(group)
 
 try:
     df_cctv = load_cctv_df()
@@ -257,6 +518,7 @@ news_end_date = None;
 event_start_date = None;
 event_end_date = None;
 selected_district = None;
+time_option = "รายวัน";
 event_time_option = "รายวัน";
 
 # --- Layer Checkboxes ---
@@ -268,6 +530,10 @@ cb_inprogress = False;
 cb_notstart =  False;
 cb_heatmap = False;
 cb_pointmap = False;
+cb_viewport = False;
+cb_canvas = False;
+cb_cluster = False;
+flood_canvas = False;
 cb_police = False;
 cb_population = False;
 cb_flood = False;
@@ -362,6 +628,9 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
+# Not an st.fragment: every widget below feeds the map or the tabs, so each
+# change would have to st.rerun(scope="app") anyway (a fragment rerun also
+# cannot hand its values back to the script), adding a sidebar-only run per click.
 with st.sidebar:
     st.markdown("<div class='sidebar-title'>Layers</div>", unsafe_allow_html=True)
     cb_complaint = st.checkbox("ปัญหาร้องเรียน")
@@ -393,6 +662,8 @@ with st.sidebar:
             st.markdown('<div class="filter-section">ประเภท</div>', unsafe_allow_html=True)
             cb_heatmap = st.checkbox("Heatmap")
             cb_pointmap = st.checkbox("Point map")
+            cb_viewport = st.checkbox("แสดงเฉพาะพื้นที่บนแผนที่", key="viewport_mode")
+            cb_canvas = st.checkbox("Canvas (จุดจำนวนมาก)", key="canvas_mode")
 
             st.markdown('<hr class="filter-hr">', unsafe_allow_html=True)
 
@@ -675,6 +946,7 @@ with st.sidebar:
             st.markdown('<div class="filter-section">ประเภทแผนที่</div>', unsafe_allow_html=True)
             flood_pointmap = st.checkbox("Point map", key="flood_pointmap")
             flood_heatmap = st.checkbox("Heatmap", key="flood_heatmap")
+            flood_canvas = st.checkbox("Canvas (จุดจำนวนมาก)", key="flood_canvas")
             
             st.markdown("---")
 
@@ -694,6 +966,33 @@ with st.sidebar:
                     selected_status.append(status) 
 
 
+    cb_cluster = st.checkbox("รวมกลุ่มจุดตามระดับซูม", key="cluster_layer")
+
+    # ----------------------------
+    # selected districts, categories and status
+    # ----------------------------
+    # read from session_state before the checkboxes render, so their labels
+    # can show facet counts under the current selection
+    selected_districts = [
+        key.replace("district_", "")
+        for key, val in st.session_state.items()
+        if key.startswith("district_") and val
+    ]
+    selected_categories = [c for c in BASE_CATEGORIES if st.session_state.get(f"category_{c}", False)]
+
+    status_cols = []
+    if cb_done:
+        status_cols.append("เสร็จสิ้น")
+    if cb_inprogress:
+        status_cols.append("กำลังดำเนินการ")
+    if cb_notstart:
+        status_cols.append("รอรับเรื่อง")
+
+    # shared across sessions and synced by data_version; filters below select
+    # row positions out of the store
+    ticket_sync = get_ticket_sync(limit=100000, start_date=start_date, end_date=end_date)
+    ticket_store = ticket_sync.refresh()
+
     st.markdown('<hr style="border:0.5px solid rgba(255,255,255,0.4); margin:10px 0;">', unsafe_allow_html=True)
     st.markdown("<div class='sidebar-title'>เขต</div>", unsafe_allow_html=True)
     district_map = {
@@ -713,11 +1012,14 @@ with st.sidebar:
         'ป้อมปราบฯ'
     ]
 
+    # reassigned every run: a label change (the counts) recreates the widget,
+    # and only a value set through session_state carries over to the new one
     for d_ui in districts:
         d_internal = district_map.get(d_ui, d_ui)
         key = f"district_{d_internal}"
-        if key not in st.session_state:
-            st.session_state[key] = False
+        st.session_state[key] = st.session_state.get(key, False)
+
+    district_counts = ticket_store.facet_counts("district", categories=selected_categories, states=status_cols)
 
 
     with st.expander("เลือกเขต"):
@@ -726,7 +1028,7 @@ with st.sidebar:
 
         def show_checkbox(d_ui, col):
             d_internal = district_map.get(d_ui, d_ui)
-            col.checkbox(d_ui, key=f"district_{d_internal}")
+            col.checkbox(f"{d_ui} ({district_counts.get(d_internal, 0):,})", key=f"district_{d_internal}")
 
         for d_ui in districts[:half]:
             show_checkbox(d_ui, col1)
@@ -774,19 +1076,14 @@ with st.sidebar:
     st.markdown("<div class='sidebar-title'>ประเภท</div>", unsafe_allow_html=True)
 
         
-    categories = [
-        "ถนน", "แสงสว่าง", "ทางเท้า", "น้ำท่วม", "ร้องเรียน",
-        "จราจร", "กีดขวาง", "ความสะอาด", "ความปลอดภัย",
-        "ท่อระบายน้ำ", "เสียง", "ป้าย", "ต้นไม้", "สะพาน",
-        "คลอง", "สัตว์จรจัด", "สายไฟ", "PM2.5", "คนจรจัด",
-        "สอบถาม", "เสนอแนะ", "ห้องน้ำ", "การเดินทาง", "ป้ายจราจร", "อื่น ๆ"
-    ]
+    categories = BASE_CATEGORIES
 
-    # initialize session_state
+    # initialize session_state (reassigned every run, as for the districts)
     for c in categories:
         key = f"category_{c}"
-        if key not in st.session_state:
-            st.session_state[key] = False
+        st.session_state[key] = st.session_state.get(key, False)
+
+    category_counts = ticket_store.facet_counts("type_filtered", districts=selected_districts, states=status_cols)
 
         
     with st.expander("เลือกประเภท"):
@@ -794,7 +1091,7 @@ with st.sidebar:
         col1, col2 = st.columns(2)
 
         def show_checkbox(c, col):
-            col.checkbox(c, key=f"category_{c}")
+            col.checkbox(f"{c} ({category_counts.get(c, 0):,})", key=f"category_{c}")
 
         for c in categories[:half]:
             show_checkbox(c, col1)
@@ -840,120 +1137,129 @@ with st.sidebar:
     
 
 
-df = get_map_data(limit=100000, start_date=start_date, end_date=end_date)
-
-
-# ============================
-# Calculate ETA by district
-# ============================
-def calculate_eta_by_district(df, start_date, end_date, selected_types, selected_districts):
-    df2 = df.copy()
-
-    df2 = df2[
-        (df2["timestamp"].dt.date >= start_date) &
-        (df2["timestamp"].dt.date <= end_date)
-    ]
-
-    if selected_types:
-        df2 = df2[df2["type"].isin(selected_types)]
-
-    if selected_districts:
-        df2 = df2[df2["district"].isin(selected_districts)]
-        
 
-    return df2.groupby("district", as_index=False)["eta_hours"].mean()
+# selections whose sliced result a ticket_aggregate_holder keeps per data version
+AGGREGATE_RESULTS_MAX = 32
 
+def new_ticket_aggregates():
+    return {
+        "cube": TicketCube(),
+        "heat": GroupedHeatGrids(TicketCube.KEY),
+    }
 
-# ----------------------------
-# filter timestamp column
-# ----------------------------
-df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
-
-df = df.dropna(subset=['timestamp'])
-
-df_filtered = df.copy()
-
-# ----------------------------
-# filter by selected districts
-# ----------------------------
-selected_districts = [
-    key.replace("district_", "")
-    for key, val in st.session_state.items()
-    if key.startswith("district_") and val
-]
-# ----------------------------
-# filter by selected categories
-# ----------------------------
-
-base_categories = [
-    "ถนน", "แสงสว่าง", "ทางเท้า", "น้ำท่วม", "ร้องเรียน",
-    "จราจร", "กีดขวาง", "ความสะอาด", "ความปลอดภัย",
-    "ท่อระบายน้ำ", "เสียง", "ป้าย", "ต้นไม้", "สะพาน",
-    "คลอง", "สัตว์จรจัด", "สายไฟ", "PM2.5", "คนจรจัด",
-    "สอบถาม", "เสนอแนะ", "ห้องน้ำ", "การเดินทาง", "ป้ายจราจร", "อื่น ๆ"
-]
-
-selected_categories = [c for c in base_categories if st.session_state.get(f"category_{c}", False)]
-
-def map_type(x):
-    if pd.isna(x) or str(x).strip() == "":
-        return "อื่น ๆ"
-    for cat in base_categories: 
-        if cat.strip() in str(x):
-            return cat
-    return "อื่น ๆ"
+def add_ticket_aggregates(aggregates, frame, sign=1):
+    """
+    Add (sign=-1: remove) the rows of frame to the accumulators.
+    """
+    if "type_filtered" not in frame:
+        frame = frame.assign(type_filtered=classify_types(frame["type"]))
+    aggregates["cube"].add(frame, sign)
+    aggregates["heat"].add(frame, sign)
+
+def build_ticket_aggregates(ticket_sync, store, history):
+    aggregates = new_ticket_aggregates()
+    window = store.frame()
+    add_ticket_aggregates(aggregates, window)
+
+    # a full window leaves older tickets out; the history streams those once
+    if history and len(store) >= ticket_sync.limit:
+        oldest = window["timestamp"].min()
+        tied = window.loc[window["timestamp"] == oldest, "ticket_id"].tolist()
+        with st.spinner("กำลังรวบรวมข้อมูลทุกปี..."):
+            for chunk in iter_map_data(
+                ticket_sync.start_date, ticket_sync.end_date,
+                before=oldest.to_pydatetime(), exclude_ids=tied
+            ):
+                add_ticket_aggregates(aggregates, chunk)
+    return aggregates
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def ticket_aggregate_holder(window, history):
+    """
+    Process-wide accumulators of one window, shared by every selection;
+    sync_ticket_aggregates keeps them current.
+    """
+    return {"lock": threading.Lock(), "aggregates": None, "version": None, "results": OrderedDict()}
 
-df_filtered['type_filtered'] = df_filtered['type'].apply(map_type)
+def sync_ticket_aggregates(ticket_sync, selection, history=False):
+    """
+    District summary, (district, type) counts and heat grids of the tickets
+    matching selection (districts, categories, states) in the sync's window
+    or, with history, of every ticket in its date range. The accumulators are
+    kept per (district, type_filtered, state), so a new selection only slices
+    them; they are updated from the TicketSync deltas since the last call and
+    rebuilt only when those no longer reach back far enough, or when a changed
+    ticket older than the window makes the history delta unknown.
+    Returns: Dict {district_summary, type_counts, heat_grids}
+    """
+    window = (ticket_sync.limit, ticket_sync.start_date, ticket_sync.end_date)
+    holder = ticket_aggregate_holder(window, history)
+    with holder["lock"]:
+        store, version, deltas = ticket_sync.since(holder["version"])
+        if holder["aggregates"] is None or deltas is None or (history and not all(d["complete"] for d in deltas)):
+            holder["aggregates"] = build_ticket_aggregates(ticket_sync, store, history)
+            holder["results"].clear()
+        else:
+            for delta in deltas:
+                add_ticket_aggregates(holder["aggregates"], delta["old"], sign=-1)
+                add_ticket_aggregates(holder["aggregates"], delta["new"])
+                # rows cut from the window are still part of the history
+                if not history:
+                    add_ticket_aggregates(holder["aggregates"], delta["dropped"], sign=-1)
+                holder["results"].clear()
+        holder["version"] = version
+
+        results = holder["results"]
+        if selection in results:
+            results.move_to_end(selection)
+        else:
+            aggregates = holder["aggregates"]
+            results[selection] = {
+                "district_summary": aggregates["cube"].district_summary(*selection),
+                "type_counts": aggregates["cube"].type_counts(*selection),
+                "heat_grids": aggregates["heat"].result(lambda index: facet_mask(index, *selection)),
+            }
+            while len(results) > AGGREGATE_RESULTS_MAX:
+                results.popitem(last=False)
+        return results[selection]
 
-if not selected_districts or not selected_categories:
-    df_filtered = df.iloc[0:0]
-else:
-    df_filtered = df_filtered[
-        df_filtered['district'].isin(selected_districts)
-        & df_filtered['type_filtered'].notna()
-    ]
+base_categories = BASE_CATEGORIES
 
+ticket_rows = ticket_store.select(selected_districts, selected_categories, status_cols)
+df_filtered = ticket_store.frame(ticket_rows)
 
 # ----------------------------
-# filter by selected status
+# district and type aggregates
 # ----------------------------
-status_cols = []
-if cb_done:
-    status_cols.append("เสร็จสิ้น")
-if cb_inprogress:
-    status_cols.append("กำลังดำเนินการ")
-if cb_notstart:
-    status_cols.append("รอรับเรื่อง")
-    
-if not selected_districts or not selected_categories:
-    df_filtered = df.iloc[0:0]
-else:
-    df_filtered = df_filtered[
-        df_filtered['district'].isin(selected_districts)
-        & df_filtered['type_filtered'].apply(lambda x: any(cat in str(x) for cat in selected_categories))
-    ]
-
-if status_cols:
-    df_filtered = df_filtered[df_filtered['state'].isin(status_cols)]
+# "ทุกปี" is larger than the store's row limit, so its aggregates cover every
+# ticket in the range (history); the map points stay the most recent rows
+ticket_aggregates = sync_ticket_aggregates(
+    ticket_sync,
+    (tuple(selected_districts), tuple(selected_categories), tuple(status_cols)),
+    history=time_option == "ทุกปี",
+)
 
 
 # ----------------------------
 # prepare data for plotting
 # ----------------------------
 df_plot = pd.DataFrame({'X': x_labels})
-for status in status_cols:
-    counts = []
-    for x in x_labels:
-        if time_option == "รายวัน":
-            mask_status = (df_filtered['state'] == status) & (df_filtered['timestamp'].dt.hour == int(x.split(':')[0]))
-        elif time_option == "รายเดือน":
-            mask_status = (df_filtered['state'] == status) & (df_filtered['timestamp'].dt.day == int(x))
-        elif time_option == "รายปี":
-            mask_status = (df_filtered['state'] == status) & (df_filtered['timestamp'].dt.month == x_labels.index(x)+1)
-        else:
-            mask_status = (df_filtered['state'] == status) & (df_filtered['timestamp'].dt.year == int(x))
-        counts.append(mask_status.sum())
-    df_plot[status] = counts
+if status_cols:
+    if selected_districts and selected_categories:
+        df_counts = get_status_time_series(
+            TIME_BUCKETS[time_option], start_date, end_date,
+            tuple(selected_districts), tuple(selected_categories), tuple(status_cols),
+            tuple(base_categories)
+        )
+    else:
+        df_counts = pd.DataFrame(columns=["bucket", "state", "count"])
+
+    counts = count_by_bucket(
+        df_counts["bucket"], df_counts["state"],
+        x_label_keys(time_option, x_labels), status_cols,
+        weights=df_counts["count"]
+    )
+    df_plot = status_plot_frame(x_labels, counts)
 
 
 # ===== Main layout =====
@@ -965,11 +1271,8 @@ def split_coords(x):
         return pd.Series({"lng": None, "lat": None})
 
 # --- Prepare map data ---
-if {"lat", "lng"}.issubset(df_filtered.columns):
-    df_map = df_filtered.dropna(subset=["lat", "lng"])
-else:
-    st.error("Missing lat/lng columns in data")
-    df_map = pd.DataFrame(columns=["lat", "lng"])
+# get_map_data already dropped rows without lat/lng
+df_map = df_filtered
     
 if df_map.empty:
     center_lat, center_lon = 13.736, 100.523
@@ -980,349 +1283,246 @@ else:
 
 # --- Map default location ---
 map_center = [13.7563, 100.5018]
-m = folium.Map(
-    location=map_center,
-    zoom_start=12,
-    tiles=f"https://api.mapbox.com/styles/v1/mapbox/streets-v11/tiles/{{z}}/{{x}}/{{y}}?access_token={MAPBOX_API_KEY}",
-    attr="Mapbox © OpenStreetMap", 
-    max_zoom=20,
-    min_zoom=1
-)
-
-# --- MarkerCluster ---
-marker_cluster = MarkerCluster().add_to(m)
 
-# ---  Default Markers ---
-if df_map.empty:
-    df_default = pd.DataFrame({
-        # "lat": [13.7563, 13.7450, 13.7654],
-        # "lon": [100.5018, 100.5231, 100.4931]
-    })
-    for _, row in df_default.iterrows():
-        folium.CircleMarker(
-            location=[row["lat"], row["lng"]],
-            radius=8,
-            color="#b400e6",
-            fill=True,
-            fill_opacity=0.6
-        ).add_to(marker_cluster)
-
-# --- Heatmap Layer ---
-if cb_heatmap and not df_map.empty:
-    heat_data = df_map[["lat", "lng"]].values.tolist()
-    HeatMap(heat_data, radius=30, min_opacity=0.1).add_to(m)
-    
-st.session_state.setdefault("clicked_ticket_id", None)
-# --- Point Layer ---
-if cb_pointmap and not df_map.empty:
-    df_map['predicted_fmt'] = df_map.apply(compute_predicted_fmt, axis=1)
-    status_color_map = {
-        "เสร็จสิ้น": "#66BB6A",
-        "กำลังดำเนินการ": "#FFCA28",
-        "รอรับเรื่อง": "#EF5350"
-    }
-    
-    text_color_map = {
-        "เสร็จสิ้น": "#49a54e",
-        "กำลังดำเนินการ": "#aa8000",
-        "รอรับเรื่อง": "#ed3c39"
-    }
+# fetched on first use only, by the map layers or tab2
+news_query = LazyQuery(get_bma_news, limit=10000, start_date=news_start_date, end_date=news_end_date)
+event_query = LazyQuery(get_bma_events, start_date=event_start_date, end_date=event_end_date)
 
-    for _, row in df_map.iterrows():
-        state = row["state"]
-        color = status_color_map.get(state, "#999999")
-        text_color = text_color_map.get(state, "#777777")
-        ticket_id = row.get("ticket_id", None)
-        predicted_fmt = row.get("predicted_fmt", "-")
-        subdistrict = row.get("subdistrict", "")
-        district = row.get("district", "")
-        comment = row.get("comment", "")
-        organization = row.get("organization", "")
-        organization_action = row.get("organization_action", "")
-        photo_url = row.get("photo") or "https://via.placeholder.com/300x200?text=No+Image"
-        raw_ts = row.get("timestamp")
-        try:
-            ts_format = pd.to_datetime(raw_ts).strftime("%d/%m/%Y %H:%M")
-        except:
-            ts_format = raw_ts
-
-        state_badge = f"""
-            <span style="
-                border: 1px solid {color};
-                background-color: {color}4D; 
-                color: {text_color};
-                font-weight: 700;
-                padding: 2px 8px;
-                border-radius: 16px;
-                font-size: 11px;
-                display: inline-block;
-            ">{state}</span>
-        """
-
-        bottom_box_html = f"""
-        <div style="
-            padding: 6px 10px;
-            margin-top: 6px;
-            background-color: {color}33;
-            border: 1px solid {color};
-            border-radius: 8px;
-            font-size: 14px;
-        ">
-            <span style="display:block; margin-bottom:4px; font-size:11px; color:#888;">
-                {"เวลาในการดำเนินการ" if state=="เสร็จสิ้น" else "ประมาณการเวลาดำเนินการแก้ไข"}
-            </span>
-            <span style="display:block; color:{text_color}; font-weight:700; margin-bottom:2px;">
-                {format_duration(row['duration_minutes_total']) if state=="เสร็จสิ้น" else predicted_fmt}
-            </span>
-        </div>
-        """
-
-        popup_html = f"""
-        <div style="font-family:'Sarabun', sans-serif; font-size:14px; line-height:1.3; width:100%; height:100%; display:flex; flex-direction:column; border-radius:8px;">
-            <div style="overflow-y:auto; flex:1; padding:6px 10px; background-color:white; color:#6c6c6c;">
-                <div style="display:flex; justify-content:space-between; align-items:center; margin-bottom:8px;">
-                    <div>{state_badge}</div>
-                    <div style="font-size:11px;"><b>แจ้งเมื่อ</b> {ts_format}</div>
-                </div>
-                <img src="{photo_url}" width="100%" style="border-radius:10px;">
-                <div style="margin:8px 0;">{district} {subdistrict}</div>
-                <div style="margin-bottom:6px;"><b>ปัญหา:</b> {comment}</div>
-                <div style="margin-bottom:6px;"><b>หน่วยงานที่รับเรื่อง:</b> {organization}</div>
-                <div><b>การดำเนินการ:</b> {organization_action}</div> 
-                
-            </div>
-            {bottom_box_html}
-        </div>
-        """
-
-        iframe = folium.IFrame(html=popup_html, width=270, height=400)
-        popup = folium.Popup(iframe, max_width=270)
-
-        folium.CircleMarker(
-            location=[row["lat"], row["lng"]],
-            radius=8,
-            color=color,
-            fill=True,
-            fill_color=color,
-            fill_opacity=0.7,
-            popup=popup
-        ).add_to(m)
-
-
-
-news_data = get_bma_news(limit= 10000,start_date=news_start_date, end_date=news_end_date)
-if cb_news and news_data:
-    for news in news_data:
-        try:
-            news_date = datetime.strptime(news['news_date'], "%Y-%m-%d").strftime("%d/%m/%Y")
-        except Exception:
-            news_date = news['news_date']
-            
-        icon = folium.CustomIcon(
-            icon_image="https://img.icons8.com/?size=100&id=VzgzXxIQUeYS&format=png&color=AF94D9",
-            icon_size=(36, 36), 
+@st.fragment
+def main_map(df_map, ticket_heat_grids, news_query, event_query):
+    """
+    Map layers and st_folium; panning, zooming and marker clicks rerun only this.
+    """
+    news_data = news_query.get() if cb_news else []
+    event_data = event_query.get() if cb_event else []
+
+    # last view reported by st_folium (viewport mode only)
+    map_view = st.session_state.get("main_map") or {}
+    view_bounds = map_view.get("bounds")
+    if not view_bounds or view_bounds.get("_southWest", {}).get("lat") is None:
+        view_bounds = BANGKOK_BOUNDS
+    view_zoom = map_view.get("zoom") or 12
+    view_center = map_view.get("center") or {"lat": map_center[0], "lng": map_center[1]}
+
+    def base_map():
+        m = folium.Map(
+            location=map_center,
+            zoom_start=12,
+            tiles=f"https://api.mapbox.com/styles/v1/mapbox/streets-v11/tiles/{{z}}/{{x}}/{{y}}?access_token={MAPBOX_API_KEY}",
+            attr="Mapbox © OpenStreetMap",
+            max_zoom=20,
+            min_zoom=1,
+            prefer_canvas=cb_canvas
         )
+        m.get_root().html.add_child(folium.Element("""
+        <style>
+            .leaflet-interactive:focus {
+                outline: none !important;
+            }
+        </style>
+        """))
+        return m
+
+    # static layers as (name, signature, build); cached_layer builds each once per signature.
+    # Signatures also key the process-wide map HTML cache, so each carries its data version.
+    map_layers = []
+
+    def add_layer(name, signature, build):
+        map_layers.append((name, signature, build))
+
+    st.session_state.setdefault("clicked_ticket_id", None)
+    # zoom/bounds-dependent markers; sent through st_folium so the base map is not re-rendered
+    fg_dynamic = folium.FeatureGroup(name="dynamic")
+    use_dynamic = False
+    # identifies df_map for the cached cluster index and heat grids
+    ticket_signature = (
+        start_date, end_date, tuple(selected_districts), tuple(selected_categories),
+        tuple(status_cols), ticket_sync.version
+    )
 
-        folium.Marker(
-            location=[news['lat'], news['lng']],
-            icon=icon,
-            popup=folium.Popup(
-                html=f"""
-                <div style="
-                    font-family: 'Sarabun', sans-serif;
-                    font-size: 14px;
-                    line-height: 1.4;
-                    padding: 8px 12px;
-                    color: #AF94D9;
-                    background-color: #FFFFFF;
-                    border-radius: 8px;
-                    max-height: 250px;
-                    overflow-y: auto;
-                    width: 250px;
-                ">
-                    <b>ข่าว:</b> {news['title']}<br>
-                    <b>วันที่:</b> {news['news_date']}<br>
-                    <b>รายละเอียด:</b> {news['description']}<br>
-                    <b>แหล่งที่มา:</b> {news['source']}
-                </div>
-                """,
-                max_width=350
-            )
-        ).add_to(marker_cluster)
-
-event_icon_map = {
-    "รถเสีย": "https://img.icons8.com/?size=200&id=cfzK1yg4WznQ&format=png&color=0096FF",
-    "คืบหน้าอุบัติเหตุ": "https://img.icons8.com/?size=100&id=bcBPOpoJ9e5q&format=png&color=73c468",
-    "เหตุไฟฟ้าลัดวงจร": "https://img.icons8.com/?size=100&id=XwGugoA70UaI&format=png&color=e35f5f",
-    "เพลิงไหม้": "https://img.icons8.com/?size=100&id=9272&format=png&color=e35f5f",
-    "เหตุเพลิงไหม้หญ้า": "https://img.icons8.com/?size=100&id=10123&format=png&color=e35f5f",
-    "คืบหน้าเหตุเพลิงไหม้หญ้า": "https://img.icons8.com/?size=100&id=10123&format=png&color=73c468",
-    "คืบหน้าไฟฟ้าลัดวงจรภายในอพาร์ทเม้นท์": "https://img.icons8.com/?size=100&id=XwGugoA70UaI&format=png&color=73c468",
-    "คืบหน้าเพลิงไหม้": "https://img.icons8.com/?size=100&id=9272&format=png&color=73c468",
-    "อุบัติเหตุ": "https://img.icons8.com/?size=100&id=bcBPOpoJ9e5q&format=png&color=FF8904",
-    "เหตุไฟฟ้าลัดวงจรที่หม้อแปลงไฟฟ้า": "https://img.icons8.com/?size=100&id=XwGugoA70UaI&format=png&color=e35f5f",
-    "ปิดการจราจร": "https://img.icons8.com/?size=100&id=nBPNgk9bLpff&format=png&color=edd161"
-}
-
-event_data = get_bma_events(start_date=event_start_date, end_date=event_end_date)
-if cb_event and event_data and cb_event_pointmap:
-    for event in event_data:
-        try:
-            start_date_str = event['start_date'].strftime("%d/%m/%Y") if event['start_date'] else "-"
-            end_date_str = event['end_date'].strftime("%d/%m/%Y") if event['end_date'] else "-"
-        except Exception:
-            start_date_str = event['start_date']
-            end_date_str = event['end_date']
-            
-        event_type = event['title_th'].split()[0] if event['title_th'] else "อื่นๆ"
-        icon_url = event_icon_map.get(event_type, "https://img.icons8.com/?size=100&id=tn6WXIuAZamL&format=png&color=AF94D9")  # icon default
-
-        icon = folium.CustomIcon(
-            icon_image=icon_url,
-            icon_size=(30, 30) if event_type != "รถเสีย" else (40, 40) 
+    # --- Heatmap Layer ---
+    if cb_heatmap and not df_map.empty:
+        add_heatmap(
+            fg_dynamic, "tickets", ticket_signature, df_map["lat"], df_map["lng"], view_zoom, view_bounds,
+            grids=ticket_heat_grids
         )
-
-        folium.Marker(
-            location=[event['lat'], event['lng']],
-            icon=icon,
-            popup=folium.Popup(
-                html=f"""
-                <div style="
-                    font-family: 'Sarabun', sans-serif;
-                    font-size: 14px;
-                    line-height: 1.4;
-                    padding: 6px 10px;
-                    color: #AF94D9;
-                    background-color: #FFFFFF;
-                    border-radius: 8px;
-                    max-height: 250px;
-                    overflow-y: auto;
-                    width: 250px;
-                ">
-                    <b>กิจกรรม:</b> {event['title_th']}<br>
-                    <b>วันที่:</b> {start_date_str}<br>
-                    <b>รายละเอียด:</b> {event['desc_th']}
-                </div>
-                """,
-                max_width=350
+        use_dynamic = True
+
+    # --- Point Layer ---
+    if cb_pointmap and not df_map.empty and cb_canvas:
+        def build_ticket_canvas(group):
+            ticket_labels = (
+                df_map["state"].astype(str) + "<br>" + df_map["type"].astype(object).fillna("").astype(str)
+                + "<br>" + df_map["timestamp"].dt.strftime("%d/%m/%Y %H:%M")
             )
-        ).add_to(m)
-        
-if cb_event and event_data and cb_event_heatmap:
-    heat_data = [[event['lat'], event['lng']] for event in event_data if event['lat'] and event['lng']]
-    HeatMap(heat_data, radius=30, min_opacity=0.1).add_to(m)    
-
-if cb_police:
-    police_data = get_police_stations()
-    if police_data:
-        for station in police_data:
-            folium.Marker(
-            location=[station['lat'], station['lng']],
-            icon=folium.DivIcon(
-                html=f"""
-                <div style="
-                    background-color:#A06CD5;
-                    width:18px;
-                    height:18px;
-                    border-radius:50%;
-                    border:2px solid white;
-                    box-shadow: 0 0 3px rgba(0,0,0,0.5);
-                "></div>
-                """
-            ),
-            popup=folium.Popup(
-                html=f"""
-                <div style="
-                    font-family: 'Sarabun', sans-serif;
-                    font-size: 14px;
-                    color: #777777;
-                    background-color: #FFFFFF;
-                    border-radius: 8px;
-                    width: 230px;
-                    display: flex;
-                    flex-direction: column;
-                    max-height: 250px;
-                ">
-                    <div style="overflow-y: auto; flex: 1; padding: 6px 10px;">
-                        <b>สถานีตำรวจ</b><br> {station['name']}<br><br>
-                        <b>แผนก</b><br> {station['division']}<br><br>
-                        <b>ที่อยู่</b><br> {station['address']}
-                    </div>
-                    <div style="padding: 6px 10px; border-top: 1px solid #eee; display:flex; align-items:center; gap:6px;">
-                        <img src="https://img.icons8.com/?size=100&id=ufkkYBXJSuPy&format=png&color=000000" 
-                            width="20" height="20" style="vertical-align:middle;">
-                        <span>{station['tel']}</span>
-                    </div>
-                </div>
-                """,
-                max_width=350
+            canvas_points(df_map, "state", status_color_map, labels=ticket_labels).add_to(group)
+        add_layer("tickets", ("canvas", ticket_signature), build_ticket_canvas)
+
+    elif cb_pointmap and not df_map.empty:
+        # popups are not inlined; details load through get_ticket when a marker is clicked
+        use_dynamic = True
+        if cb_cluster:
+            # only single markers resolve to a ticket; a click on a cluster
+            # bubble must not pick whichever ticket lies under its centroid
+            singles = add_clustered(
+                fg_dynamic, "tickets", ticket_signature,
+                df_map, lambda i: ticket_marker(df_map.iloc[i]), "#AF94D9", view_zoom, view_bounds
             )
-        ).add_to(m)
+            df_points = df_map.iloc[singles]
+        else:
+            if cb_viewport:
+                df_points = viewport_rows(df_map, view_bounds, VIEWPORT_MAX_MARKERS)
+            else:
+                df_points = df_map
 
-if cb_population:
-    df_population = pd.DataFrame(get_bangkok_population())
+            for _, row in df_points.iterrows():
+                ticket_marker(row).add_to(fg_dynamic)
 
-    url = "https://services1.arcgis.com/jSaRWj2TDlcN1zOC/arcgis/rest/services/TH_Bangkok_District/FeatureServer/0/query"
-    params = {"where": "1=1", "outFields": "*", "f": "geojson"}
-    res = requests.get(url, params=params)
-    geojson_data = res.json()
 
-    pop_type_label_map = {
-        "total_population": "ประชากรทั้งหมด",
-        "male_population": "ประชากรชาย",
-        "female_population": "ประชากรหญิง",
+    if cb_news and news_data:
+        if cb_cluster:
+            add_clustered(
+                fg_dynamic, "news", (news_start_date, news_end_date, table_version("bma_news")),
+                pd.DataFrame(news_data), lambda i: news_marker(news_data[i]), "#AF94D9", view_zoom, view_bounds
+            )
+            use_dynamic = True
+        else:
+            def build_news(group):
+                news_cluster = MarkerCluster().add_to(group)
+                for news in news_data:
+                    news_marker(news).add_to(news_cluster)
+            add_layer("news", (news_start_date, news_end_date, table_version("bma_news")), build_news)
+
+    event_icon_map = {
+        "รถเสีย": "https://img.icons8.com/?size=200&id=cfzK1yg4WznQ&format=png&color=0096FF",
+        "คืบหน้าอุบัติเหตุ": "https://img.icons8.com/?size=100&id=bcBPOpoJ9e5q&format=png&color=73c468",
+        "เหตุไฟฟ้าลัดวงจร": "https://img.icons8.com/?size=100&id=XwGugoA70UaI&format=png&color=e35f5f",
+        "เพลิงไหม้": "https://img.icons8.com/?size=100&id=9272&format=png&color=e35f5f",
+        "เหตุเพลิงไหม้หญ้า": "https://img.icons8.com/?size=100&id=10123&format=png&color=e35f5f",
+        "คืบหน้าเหตุเพลิงไหม้หญ้า": "https://img.icons8.com/?size=100&id=10123&format=png&color=73c468",
+        "คืบหน้าไฟฟ้าลัดวงจรภายในอพาร์ทเม้นท์": "https://img.icons8.com/?size=100&id=XwGugoA70UaI&format=png&color=73c468",
+        "คืบหน้าเพลิงไหม้": "https://img.icons8.com/?size=100&id=9272&format=png&color=73c468",
+        "อุบัติเหตุ": "https://img.icons8.com/?size=100&id=bcBPOpoJ9e5q&format=png&color=FF8904",
+        "เหตุไฟฟ้าลัดวงจรที่หม้อแปลงไฟฟ้า": "https://img.icons8.com/?size=100&id=XwGugoA70UaI&format=png&color=e35f5f",
+        "ปิดการจราจร": "https://img.icons8.com/?size=100&id=nBPNgk9bLpff&format=png&color=edd161"
     }
 
-    min_val = int(df_population[pop_type].min())
-    max_val = int(df_population[pop_type].max())
-
-    for feature in geojson_data["features"]:
-        district_name = feature["properties"].get("AMP_NAMT")
+    if cb_event and event_data and cb_event_pointmap:
+        def build_event_points(group):
+            for event in event_data:
+                try:
+                    start_date_str = event['start_date'].strftime("%d/%m/%Y") if event['start_date'] else "-"
+                except Exception:
+                    start_date_str = event['start_date']
 
-        match = df_population[df_population["district_name"] == district_name]
+                event_type = event['title_th'].split()[0] if event['title_th'] else "อื่นๆ"
+                icon_url = event_icon_map.get(event_type, "https://img.icons8.com/?size=100&id=tn6WXIuAZamL&format=png&color=AF94D9")  # icon default
 
-        if not match.empty:
-            val = int(match[pop_type].iloc[0])  
-            fill_color = value_to_color(val, min_val, max_val, type='time')
+                icon = folium.CustomIcon(
+                    icon_image=icon_url,
+                    icon_size=(30, 30) if event_type != "รถเสีย" else (40, 40) 
+                )
 
-            feature["properties"]["value"] = val
-            feature["properties"]["fillColor"] = fill_color
-        else:
-            feature["properties"]["value"] = None
-            feature["properties"]["fillColor"] = "rgba(230,230,230,0.3)"
-
-    folium.GeoJson(
-        geojson_data,
-        style_function=lambda feature: {
-            'fillColor': feature["properties"]["fillColor"],
-            'color': 'white',
-            'weight': 1,
-            'fillOpacity': 0.7,
-        },
-        tooltip=folium.GeoJsonTooltip(
-            fields=["AMP_NAMT", "value"],
-            aliases=[
-                "เขต:",
-                f"{pop_type_label_map[pop_type]} :",  
-            ],
-            labels=True,
-            sticky=True,
-            style="""
-                background-color: #AF94D9;
-                border-radius: 8px;
-                box-shadow: 3px 3px 5px rgba(0,0,0,0.3);
-                padding: 8px;
-                font-family: 'Sarabun', sans-serif;
-                color: white;
-                font-size: 13px;
-            """
-        )
-    ).add_to(m)
+                folium.Marker(
+                    location=[event['lat'], event['lng']],
+                    icon=icon,
+                    popup=folium.Popup(
+                        html=f"""
+                        <div style="
+                            font-family: 'Sarabun', sans-serif;
+                            font-size: 14px;
+                            line-height: 1.4;
+                            padding: 6px 10px;
+                            color: #AF94D9;
+                            background-color: #FFFFFF;
+                            border-radius: 8px;
+                            max-height: 250px;
+                            overflow-y: auto;
+                            width: 250px;
+                        ">
+                            <b>กิจกรรม:</b> {event['title_th']}<br>
+                            <b>วันที่:</b> {start_date_str}<br>
+                            <b>รายละเอียด:</b> {event['desc_th']}
+                        </div>
+                        """,
+                        max_width=350
+                    )
+                ).add_to(group)
+        add_layer("events", (event_start_date, event_end_date, table_version("bma_events")), build_event_points)
+
+    if cb_event and event_data and cb_event_heatmap:
+        event_points = [(event['lat'], event['lng']) for event in event_data if event['lat'] and event['lng']]
+        if event_points:
+            event_lats, event_lngs = zip(*event_points)
+            add_heatmap(
+                fg_dynamic, "events", (event_start_date, event_end_date, table_version("bma_events")),
+                event_lats, event_lngs, view_zoom, view_bounds
+            )
+            use_dynamic = True
+
+    if cb_police:
+        police_data = get_police_stations()
+        if police_data and cb_cluster:
+            add_clustered(
+                fg_dynamic, "police", table_version("police_stations"),
+                pd.DataFrame(police_data), lambda i: police_marker(police_data[i]), "#A06CD5", view_zoom, view_bounds
+            )
+            use_dynamic = True
+        elif police_data:
+            def build_police(group):
+                for station in police_data:
+                    police_marker(station).add_to(group)
+            add_layer("police", table_version("police_stations"), build_police)
+
+    # no boundaries (not bundled and the download failed): skip the district layer
+    population_geojson = district_geojson() if cb_population else None
+    if population_geojson and population_geojson["features"]:
+        def build_population(group):
+            df_population = pd.DataFrame(get_bangkok_population())
+
+            geojson_data = population_geojson
+
+            pop_type_label_map = {
+                "total_population": "ประชากรทั้งหมด",
+                "male_population": "ประชากรชาย",
+                "female_population": "ประชากรหญิง",
+            }
 
-if cb_flood and flood_pointmap:
-    csv_path = "data/flood_risk.csv"
-    df_flood = pd.read_csv(csv_path)
-    df_flood_filtered = df_flood[df_flood["status_detail"].isin(selected_status)]
+            min_val = int(df_population[pop_type].min())
+            max_val = int(df_population[pop_type].max())
+
+            df_population = df_population.drop_duplicates("district_name")
+            population_values = dict(zip(df_population["district_name"], df_population[pop_type].astype(int).tolist()))
+            choropleth_geojson(geojson_data, population_values, min_val, max_val, gradient="time")
+
+            folium.GeoJson(
+                geojson_data,
+                style_function=lambda feature: {
+                    'fillColor': feature["properties"]["fillColor"],
+                    'color': 'white',
+                    'weight': 1,
+                    'fillOpacity': 0.7,
+                },
+                tooltip=folium.GeoJsonTooltip(
+                    fields=["AMP_NAMT", "value"],
+                    aliases=[
+                        "เขต:",
+                        f"{pop_type_label_map[pop_type]} :",  
+                    ],
+                    labels=True,
+                    sticky=True,
+                    style="""
+                        background-color: #AF94D9;
+                        border-radius: 8px;
+                        box-shadow: 3px 3px 5px rgba(0,0,0,0.3);
+                        padding: 8px;
+                        font-family: 'Sarabun', sans-serif;
+                        color: white;
+                        font-size: 13px;
+                    """
+                )
+            ).add_to(group)
+        add_layer("population", (pop_type, table_version("bangkok_population")), build_population)
 
     flood_status_color = {
         "แก้ไขแล้วเสร็จ": "#66BB6A",
@@ -1332,199 +1532,224 @@ if cb_flood and flood_pointmap:
         "พื้นที่เอกชนหรือหน่วยงานราชการ": "#9292D1",
     }
 
-    text_color = {
-        "แก้ไขแล้วเสร็จ": "#33691e",
-        "แก้ไขแล้วเสร็จบางส่วน": "#f57f17",
-        "อยู่ระหว่างดำเนินการแก้ไข": "#e65100",
-        "มีมาตรการเร่งด่วน": "#b0120a",
-        "พื้นที่เอกชนหรือหน่วยงานราชการ": "#6a1b9a",
-    }
+    if cb_flood and flood_pointmap and (flood_canvas or cb_canvas):
+        def build_flood_canvas(group):
+            df_flood = pd.read_csv("data/flood_risk.csv")
+            df_flood_filtered = df_flood[df_flood["status_detail"].isin(selected_status)]
+            flood_labels = (
+                "<b>" + df_flood_filtered["name"].astype(str) + "</b><br>"
+                + df_flood_filtered["district"].astype(str) + "<br>" + df_flood_filtered["status_detail"].astype(str)
+            )
+            canvas_points(
+                df_flood_filtered, "status_detail", flood_status_color, default_color="#9E9E9E",
+                labels=flood_labels, lat_col="y", lng_col="x", fill_opacity=0.9
+            ).add_to(group)
+        add_layer("flood", ("canvas", tuple(selected_status)), build_flood_canvas)
+
+    elif cb_flood and flood_pointmap:
+        def build_flood_points(group):
+            csv_path = "data/flood_risk.csv"
+            df_flood = pd.read_csv(csv_path)
+            df_flood_filtered = df_flood[df_flood["status_detail"].isin(selected_status)]
+
+            text_color = {
+                "แก้ไขแล้วเสร็จ": "#33691e",
+                "แก้ไขแล้วเสร็จบางส่วน": "#f57f17",
+                "อยู่ระหว่างดำเนินการแก้ไข": "#e65100",
+                "มีมาตรการเร่งด่วน": "#b0120a",
+                "พื้นที่เอกชนหรือหน่วยงานราชการ": "#6a1b9a",
+            }
 
-    def format_bullet(text):
-        if pd.isna(text) or str(text).strip() == "":
-            return ""
-        lines = str(text).split("\n")
-        bullets = "".join([f"<li>{line.strip()}</li>" for line in lines if line.strip()])
-        return f"<ul style='padding-left:18px; margin:4px 0'>{bullets}</ul>"
-
-    for _, row in df_flood_filtered.iterrows():
-
-        # get data
-        name = row["name"]
-        district = row["district"]
-        status_detail = row["status_detail"]
-        problems = row["problems"]
-        detail = row["detail"]
-        remark = row["remark"]
-
-        dept_sapan = row["สพน"]
-        dept_sakon = row["สคน"]
-        dept_krb = row["กรบ"]
-        dept_krt = row["กรท"]
-
-
-        color = flood_status_color.get(status_detail, "#9E9E9E")
-        tcolor = text_color.get(status_detail, "#333")
-
-        # Badge
-        state_badge = f"""
-            <span style="
-                border: 1px solid {color};
-                background-color: {color}30; 
-                color: {tcolor};
-                font-weight: 700;
-                padding: 2px 8px;
-                border-radius: 16px;
-                font-size: 11px;
-                display: inline-block;
-                margin-bottom: 8px;
-            ">{status_detail}</span>
-        """
-
-        #  detail
-        detail_html = ""
-        if not pd.isna(detail) and str(detail).strip() != "":
-            detail_html = f"""
-                <b>รายละเอียดโครงการ:</b>
-                {format_bullet(detail)}
-                <br>
-            """
+            def format_bullet(text):
+                if pd.isna(text) or str(text).strip() == "":
+                    return ""
+                lines = str(text).split("\n")
+                bullets = "".join([f"<li>{line.strip()}</li>" for line in lines if line.strip()])
+                return f"<ul style='padding-left:18px; margin:4px 0'>{bullets}</ul>"
+
+            for _, row in df_flood_filtered.iterrows():
+
+                # get data
+                name = row["name"]
+                district = row["district"]
+                status_detail = row["status_detail"]
+                problems = row["problems"]
+                detail = row["detail"]
+                remark = row["remark"]
+
+                dept_sapan = row["สพน"]
+                dept_sakon = row["สคน"]
+                dept_krb = row["กรบ"]
+                dept_krt = row["กรท"]
+
+
+                color = flood_status_color.get(status_detail, "#9E9E9E")
+                tcolor = text_color.get(status_detail, "#333")
+
+                # Badge
+                state_badge = f"""
+                    <span style="
+                        border: 1px solid {color};
+                        background-color: {color}30; 
+                        color: {tcolor};
+                        font-weight: 700;
+                        padding: 2px 8px;
+                        border-radius: 16px;
+                        font-size: 11px;
+                        display: inline-block;
+                        margin-bottom: 8px;
+                    ">{status_detail}</span>
+                """
 
-        # remark
-        remark_html = ""
-        if not pd.isna(remark) and str(remark).strip() != "":
-            remark_html = f"""
-                <b>หมายเหตุ:</b> {remark}<br><br>
-            """
+                #  detail
+                detail_html = ""
+                if not pd.isna(detail) and str(detail).strip() != "":
+                    detail_html = f"""
+                        <b>รายละเอียดโครงการ:</b>
+                        {format_bullet(detail)}
+                        <br>
+                    """
+
+                # remark
+                remark_html = ""
+                if not pd.isna(remark) and str(remark).strip() != "":
+                    remark_html = f"""
+                        <b>หมายเหตุ:</b> {remark}<br><br>
+                    """
+
+                # dept
+                dept_html = ""
+                if any([pd.notna(dept_sapan), pd.notna(dept_sakon), pd.notna(dept_krb), pd.notna(dept_krt)]):
+
+                    dept_html += "<b>โครงการตามหน่วยงาน</b><br>"
+                    if pd.notna(dept_sapan):
+                        dept_html += f"• <b>สพน</b> {format_bullet(dept_sapan)}"
+                    if pd.notna(dept_sakon):
+                        dept_html += f"• <b>สคน</b> {format_bullet(dept_sakon)}"
+                    if pd.notna(dept_krb):
+                        dept_html += f"• <b>กรบ</b> {format_bullet(dept_krb)}"
+                    if pd.notna(dept_krt):
+                        dept_html += f"• <b>กรท</b> {format_bullet(dept_krt)}"
+
+                popup_html = f"""
+                <div style="
+                    font-family: 'Sarabun', sans-serif;
+                    font-size: 14px;
+                    color: #444;
+                    background-color: #FFFFFF;
+                    border-radius: 8px;
+                    width: 280px;
+                    padding: 12px;
+                ">
+                    {state_badge}<br>
+                    <b>ชื่อจุด:</b> {name}<br>
+                    <b>เขต:</b> {district}<br>
+                    <b>ปัญหา:</b> {problems}<br>
+                    <br>
+                    {detail_html}
+                    {remark_html}
+                    {dept_html}
+                </div>
+                """
 
-        # dept
-        dept_html = ""
-        if any([pd.notna(dept_sapan), pd.notna(dept_sakon), pd.notna(dept_krb), pd.notna(dept_krt)]):
-
-            dept_html += "<b>โครงการตามหน่วยงาน</b><br>"
-            if pd.notna(dept_sapan):
-                dept_html += f"• <b>สพน</b> {format_bullet(dept_sapan)}"
-            if pd.notna(dept_sakon):
-                dept_html += f"• <b>สคน</b> {format_bullet(dept_sakon)}"
-            if pd.notna(dept_krb):
-                dept_html += f"• <b>กรบ</b> {format_bullet(dept_krb)}"
-            if pd.notna(dept_krt):
-                dept_html += f"• <b>กรท</b> {format_bullet(dept_krt)}"
-
-        popup_html = f"""
-        <div style="
-            font-family: 'Sarabun', sans-serif;
-            font-size: 14px;
-            color: #444;
-            background-color: #FFFFFF;
-            border-radius: 8px;
-            width: 280px;
-            padding: 12px;
-        ">
-            {state_badge}<br>
-            <b>ชื่อจุด:</b> {name}<br>
-            <b>เขต:</b> {district}<br>
-            <b>ปัญหา:</b> {problems}<br>
-            <br>
-            {detail_html}
-            {remark_html}
-            {dept_html}
-        </div>
-        """
-
-        folium.CircleMarker(
-            location=[row["y"], row["x"]],
-            radius=8,
-            color=color,
-            fill=True,
-            fill_color=color,
-            fill_opacity=0.9,
-            weight=1,
-            popup=folium.Popup(popup_html, max_width=330)
-        ).add_to(m)
-        
-if cb_flood and flood_heatmap:
-    csv_path = "data/flood_risk.csv"
-    df_flood = pd.read_csv(csv_path)
-    df_flood_filtered = df_flood[df_flood["status_detail"].isin(selected_status)]
-
-    heat_data = df_flood_filtered[["y", "x"]].values.tolist()
-    HeatMap(heat_data, radius=30, min_opacity=0.1).add_to(m)
-
-# --- CCTV Layer ---
-if cb_cctv and not df_cctv.empty:
-    for _, row in df_cctv.iterrows():
-        icon = folium.CustomIcon(
-            icon_image="https://img.icons8.com/?size=100&id=PctCctSTsD41&format=png&color=AF94D9",
-            icon_size=(28, 28)
+                folium.CircleMarker(
+                    location=[row["y"], row["x"]],
+                    radius=8,
+                    color=color,
+                    fill=True,
+                    fill_color=color,
+                    fill_opacity=0.9,
+                    weight=1,
+                    popup=folium.Popup(popup_html, max_width=330)
+                ).add_to(group)
+        add_layer("flood", ("markers", tuple(selected_status)), build_flood_points)
+
+    if cb_flood and flood_heatmap:
+        csv_path = "data/flood_risk.csv"
+        df_flood = pd.read_csv(csv_path)
+        df_flood_filtered = df_flood[df_flood["status_detail"].isin(selected_status)]
+
+        add_heatmap(fg_dynamic, "flood", tuple(selected_status), df_flood_filtered["y"], df_flood_filtered["x"], view_zoom, view_bounds)
+        use_dynamic = True
+
+    # --- CCTV Layer ---
+    if cb_cctv and not df_cctv.empty and cb_canvas:
+        def build_cctv_canvas(group):
+            cctv_labels = (
+                "<b>" + df_cctv["name"].astype(str) + "</b><br>"
+                + "<img src='" + SNAPSHOT_BASE + "/" + df_cctv["id"].astype(str) + "' width='240' style='border-radius:12px;'>"
+            )
+            canvas_points(
+                df_cctv.assign(layer="cctv"), "layer", {"cctv": "#AF94D9"}, labels=cctv_labels
+            ).add_to(group)
+        add_layer("cctv", ("canvas", tuple(df_cctv["id"])), build_cctv_canvas)
+
+    elif cb_cctv and not df_cctv.empty and cb_cluster:
+        add_clustered(
+            fg_dynamic, "cctv", tuple(df_cctv["id"]),
+            df_cctv, lambda i: cctv_marker(df_cctv.iloc[i]), "#AF94D9", view_zoom, view_bounds
+        )
+        use_dynamic = True
+
+    elif cb_cctv and not df_cctv.empty:
+        def build_cctv_markers(group):
+            for _, row in df_cctv.iterrows():
+                cctv_marker(row).add_to(group)
+        add_layer("cctv", ("markers", tuple(df_cctv["id"])), build_cctv_markers)
+
+    def build_map():
+        m = base_map()
+        for name, signature, build in map_layers:
+            cached_layer(name, signature, build).add_to(m)
+        return m
+
+    # identical layers/filters/data version -> identical static map HTML
+    map_signature = (cb_canvas, tuple((name, signature) for name, signature, _ in map_layers))
+
+    if use_dynamic:
+        # markers are sent as a separate feature group, so panning does not re-render the base map;
+        # the clicked marker is reported back and its popup is rendered below the map
+        map_state = st_folium(
+            build_map(),
+            key="main_map",
+            height=640,
+            use_container_width=True,
+            center=[view_center["lat"], view_center["lng"]],
+            zoom=view_zoom,
+            feature_group_to_add=fg_dynamic,
+            returned_objects=["bounds", "zoom", "center", "last_object_clicked"],
         )
 
-        snapshot_url = f"{SNAPSHOT_BASE}/{row['id']}"
+        clicked = (map_state or {}).get("last_object_clicked")
+        clicked_idx = None
+        if clicked and cb_pointmap and not cb_canvas and not df_map.empty:
+            clicked_idx = nearest_row(df_points, clicked["lat"], clicked["lng"])
+        if clicked_idx is not None:
+            clicked_row = ticket_detail_row(df_points.loc[clicked_idx])
+            clicked_row["predicted_fmt"] = compute_predicted_fmt(clicked_row.to_frame().T).iloc[0]
+            st.session_state["clicked_ticket_id"] = clicked_row["ticket_id"]
+            components.html(ticket_popup_html(clicked_row), width=300, height=420)
+    else:
+        map_html = cached_map_html(map_signature, build_map)
 
-        popup_html = f"""
-        <div style="
-            font-family: 'Sarabun', sans-serif;
-            font-size: 14px;
-            line-height: 1.2;
-            padding: 4px 4px;
-            background-color: white;
-            color: #AF94D9;
-            border-radius: 8px;
-            text-align: left;
-        ">
-            <b style='display:block; margin-bottom:6px;'>{row['name']}</b>
-            <span style='display:block; margin-bottom:4px;'>ตำแหน่ง: {row['lat']}, {row['lng']}</span>
-            
-            <div style="margin-top:8px; text-align:center;">
-                <img id="cctv_img_{row['id']}" 
-                     src="{snapshot_url}?t={pd.Timestamp.now().timestamp()}" 
-                     width="100%" 
-                     height="180px"
-                     style="border-radius:12px;"
-                     onerror="this.src='https://via.placeholder.com/200x120?text=Offline';">
+        components.html(
+            f"""
+            <div style="width:100%; height:640px; border-radius:13px; overflow:hidden;">
+                {map_html}
             </div>
-        </div>
-
-        <script>
-            var img = document.getElementById("cctv_img_{row['id']}");
-            setInterval(function(){{
-                img.src = "{snapshot_url}?t=" + new Date().getTime();
-            }}, 1000);
-        </script>
-        """
-
-        iframe = IFrame(html=popup_html, width=280, height=260)
-        folium.Marker(
-            location=[row["lat"], row["lng"]],
-            icon=icon,
-            popup=folium.Popup(iframe, max_width=280)
-        ).add_to(m)
-
-m.get_root().html.add_child(folium.Element("""
-<style>
-    .leaflet-interactive:focus {
-        outline: none !important;
-    }
-</style>
-"""))
-
-        
-map_html = m.get_root().render()
-
-components.html(
-    f"""
-    <div style="width:100%; height:640px; border-radius:13px; overflow:hidden;">
-        {map_html}
-    </div>
-    """,
-    height=640,
-)
+            """,
+            height=640,
+        )
 
 
+main_map(df_map, ticket_aggregates["heat_grids"], news_query, event_query)
 
-tab1, tab2 = st.tabs(["ข้อมูลการร้องเรียน", "ข้อมูลเหตุการณ์จราจร"])
 
-with tab1:
+@st.fragment
+def overview_metrics():
+    """
+    Dashboard totals; independent of the sidebar filters.
+    """
     overview = get_dashboard_overview()
     if overview['last_updated']:
         last_updated_dt = datetime.datetime.fromisoformat(overview['last_updated'])
@@ -1617,7 +1842,13 @@ with tab1:
     )
 
     st.markdown("---")
-    
+
+
+@st.fragment
+def district_choropleth(district_summary):
+    """
+    District map and table; the map type selectbox reruns only this.
+    """
     districts_full = [
         'คลองสาน', 'คลองสามวา', 'คลองเตย', 'คันนายาว', 'จตุจักร', 'จอมทอง', 
         'ดอนเมือง', 'ดินแดง', 'ดุสิต', 'ตลิ่งชัน', 'ทวีวัฒนา', 'ธนบุรี', 
@@ -1631,7 +1862,6 @@ with tab1:
         'ป้อมปราบศัตรูพ่าย'
     ]
 
-    district_summary = get_district_summary_from_df(df_filtered)
     district_summary_filtered = [d for d in district_summary if d['district'] in districts_full]
     df_district_summary = pd.DataFrame(district_summary_filtered)
     df_district_summary['completion_rate'] = (df_district_summary['finished'] / df_district_summary['total'] * 100).round(2)
@@ -1653,10 +1883,7 @@ with tab1:
     max_val = df_district_summary['value'].max()
 
 
-    url = "https://services1.arcgis.com/jSaRWj2TDlcN1zOC/arcgis/rest/services/TH_Bangkok_District/FeatureServer/0/query"
-    params = {"where": "1=1", "outFields": "*", "f": "geojson"}
-    res = requests.get(url, params=params)
-    geojson_data = res.json()
+    geojson_data = district_geojson()
 
     m_2 = folium.Map(
         location=map_center,
@@ -1672,42 +1899,37 @@ with tab1:
     else:
         color_type = "time"
 
-    for feature in geojson_data["features"]:
-        district_name = feature["properties"].get("AMP_NAMT")
-        match = df_district_summary[df_district_summary["district"] == district_name]
-        
-        if not match.empty:
-            val = match['value'].iloc[0]
-            feature["properties"]["value"] = val
-            feature["properties"]["fillColor"] = value_to_color(val, min_val, max_val, color_type)
-        else:
-            feature["properties"]["value"] = None
-            feature["properties"]["fillColor"] = "rgba(230,230,230,0.3)"
-
-    folium.GeoJson(
-        geojson_data,
-        style_function=lambda feature: {
-            'fillColor': feature['properties']['fillColor'],
-            'color': 'white',
-            'weight': 1,
-            'fillOpacity': 0.7,
-        },
-        tooltip=folium.GeoJsonTooltip(
-            fields=["AMP_NAMT","value"],
-            aliases=["เขต:", value_label],
-            labels=True,
-            sticky=True,
-            style="""
-                background-color: #AF94D9;
-                border-radius: 8px;
-                box-shadow: 3px 3px 5px rgba(0,0,0,0.3);
-                padding: 8px;
-                font-family: 'Sarabun', sans-serif;
-                color: white;
-                font-size: 13px;
-            """
-        )
-    ).add_to(m_2)
+    if geojson_data["features"]:
+        df_district_values = df_district_summary.drop_duplicates("district")
+        district_values = dict(zip(df_district_values["district"], df_district_values["value"].tolist()))
+        choropleth_geojson(geojson_data, district_values, min_val, max_val, gradient=color_type)
+
+        folium.GeoJson(
+            geojson_data,
+            style_function=lambda feature: {
+                'fillColor': feature['properties']['fillColor'],
+                'color': 'white',
+                'weight': 1,
+                'fillOpacity': 0.7,
+            },
+            tooltip=folium.GeoJsonTooltip(
+                fields=["AMP_NAMT","value"],
+                aliases=["เขต:", value_label],
+                labels=True,
+                sticky=True,
+                style="""
+                    background-color: #AF94D9;
+                    border-radius: 8px;
+                    box-shadow: 3px 3px 5px rgba(0,0,0,0.3);
+                    padding: 8px;
+                    font-family: 'Sarabun', sans-serif;
+                    color: white;
+                    font-size: 13px;
+                """
+            )
+        ).add_to(m_2)
+    else:
+        st.warning("ไม่สามารถโหลดขอบเขตเขตได้ แผนที่จะแสดงโดยไม่มีข้อมูลรายเขต")
     
     m_2.get_root().html.add_child(folium.Element("""
     <style>
@@ -1725,7 +1947,6 @@ with tab1:
         height=600
     )    
     
-    district_summary = get_district_summary_from_df(df_filtered)
     district_summary_filtered = [d for d in district_summary if d['district'] in districts_full]
 
     df_district_summary = pd.DataFrame(district_summary_filtered)
@@ -1742,15 +1963,17 @@ with tab1:
     with st.expander("ดูตารางสถิติการจัดการเรื่องร้องเรียนตามเขต"):
         st.dataframe(df_district_summary)
     st.markdown("---")
-        
-    # if "type_filtered" not in df_filtered.columns:
-    #     if "type" in df_filtered.columns:
-    #         df_filtered["type_filtered"] = df_filtered["type"].fillna("ไม่ระบุ")
-    #     else:
-    #         df_filtered["type_filtered"] = "ไม่ระบุ"
-    df_filtered["district"] = df_filtered["district"].fillna("").str.strip()
 
-    district_count = df_filtered.groupby("district").size().reset_index(name="count")
+
+@st.fragment
+def status_charts(type_counts, df_plot, status_cols):
+    """
+    Top districts and status charts; the chart selectboxes rerun only this.
+    type_counts: ticket counts indexed by (district, type_filtered)
+    """
+    district_totals = type_counts.groupby(level="district").sum()
+    district_totals = district_totals.groupby(district_totals.index.str.strip()).sum()
+    district_count = district_totals.rename_axis("district").reset_index(name="count")
 
     top_districts = district_count.sort_values("count", ascending=False).head(15)["district"]
 
@@ -1788,34 +2011,12 @@ with tab1:
     with col4:
         selected_district = st.selectbox("", options=list(top_districts))
 
-    # df_melt = df_plot.melt(id_vars=["X"], value_vars=status_cols, var_name="สถานะ", value_name="จำนวน")
-    
-    valid_status_cols = [c for c in status_cols if c in df_plot.columns]
-
-    if data_type == "แยกตามสถานะ":
-        df_melt = df_plot.melt(
-            id_vars=["X"],
-            value_vars=valid_status_cols,
-            var_name="สถานะ",
-            value_name="จำนวน"
-        )
-
-        if cumulative_left == "สะสม":
-            df_melt["จำนวน"] = df_melt.groupby("สถานะ")["จำนวน"].cumsum()
-
-    else:
-        if len(valid_status_cols) == 0:
-            df_melt = df_plot[["X"]].copy()
-            df_melt["จำนวน"] = 0
-        else:
-            df_melt = df_plot[["X"] + valid_status_cols].copy()
-            df_melt["จำนวน"] = df_melt[valid_status_cols].sum(axis=1)
-            df_melt = df_melt[["X", "จำนวน"]]
-
-        df_melt["สถานะ"] = "รวมทั้งหมด"
-
-        if cumulative_left == "สะสม":
-            df_melt["จำนวน"] = df_melt["จำนวน"].cumsum()
+    df_melt = melt_status_plot(
+        df_plot,
+        status_cols,
+        combined=(data_type == "รวมทุกสถานะ"),
+        cumulative=(cumulative_left == "สะสม")
+    )
 
     status_color = {
         "เสร็จสิ้น": "#73c468",       
@@ -1892,8 +2093,8 @@ with tab1:
             "#6247AA"
         ]
 
-        df_district = df_filtered[df_filtered["district"] == selected_district]
-        pie_df = df_district['type_filtered'].value_counts().reset_index()
+        district_types = type_counts[type_counts.index.get_level_values("district") == selected_district]
+        pie_df = district_types.groupby(level="type_filtered").sum().sort_values(ascending=False).reset_index()
         pie_df.columns = ['type_filtered', 'count']
 
         pie_chart = alt.Chart(pie_df).mark_arc(innerRadius=50).encode(
@@ -1914,7 +2115,18 @@ with tab1:
         st.altair_chart(pie_chart, use_container_width=True)
 
 
-with tab2:
+@st.fragment
+def events_tab(event_query, news_query):
+    """
+    Event and news charts for tab2. Loaded on demand, unless the map already needs them.
+    """
+    if not st.toggle("แสดงข้อมูลเหตุการณ์และข่าว", value=cb_news or cb_event):
+        st.info("เปิดเพื่อโหลดข้อมูลเหตุการณ์และข่าวในช่วงวันที่เลือก")
+        return
+
+    event_data = event_query.get()
+    news_data = news_query.get()
+
     if not event_data and not news_data:
         st.info("ไม่พบข้อมูลเหตุการณ์ในช่วงวันที่เลือก")
     else:
@@ -2025,4 +2237,15 @@ with tab2:
                 font='Sarabun'
             )
 
-            st.altair_chart(chart_type, use_container_width=True)
\ No newline at end of file
+            st.altair_chart(chart_type, use_container_width=True)
+
+
+tab1, tab2 = st.tabs(["ข้อมูลการร้องเรียน", "ข้อมูลเหตุการณ์จราจร"])
+
+with tab1:
+    overview_metrics()
+    district_choropleth(ticket_aggregates["district_summary"])
+    status_charts(ticket_aggregates["type_counts"], df_plot, status_cols)
+
+with tab2:
+    events_tab(event_query, news_query)
@@ -0,0 +1,79 @@
+"""
+Benchmark: SVG CircleMarkers vs map_utils.CanvasPoints.
+
+For each size, builds and renders the folium map both ways and reports the
+Python build/render time and the HTML payload size. The HTML files are written
+to a temp directory; open them in a browser and read the console.debug line
+CanvasPoints(timing=True) logs for the client-side draw time. Run from the repo root:
+
+    python benchmarks/bench_canvas_render.py [--svg-max 100000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import folium
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from map_utils import canvas_points  # noqa: E402
+
+STATUS_COLOR_MAP = {
+    "เสร็จสิ้น": "#66BB6A",
+    "กำลังดำเนินการ": "#FFCA28",
+    "รอรับเรื่อง": "#EF5350"
+}
+
+
+def synthetic_points(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "lat": rng.uniform(13.55, 13.95, n),
+        "lng": rng.uniform(100.35, 100.90, n),
+        "state": rng.choice(list(STATUS_COLOR_MAP), n),
+    })
+
+
+def svg_map(df):
+    m = folium.Map(location=[13.7563, 100.5018], zoom_start=11)
+    for lat, lng, state in df[["lat", "lng", "state"]].itertuples(index=False):
+        color = STATUS_COLOR_MAP[state]
+        folium.CircleMarker([lat, lng], radius=6, color=color, fill=True, fill_color=color).add_to(m)
+    return m
+
+
+def canvas_map(df):
+    m = folium.Map(location=[13.7563, 100.5018], zoom_start=11, prefer_canvas=True)
+    canvas_points(df, "state", STATUS_COLOR_MAP, labels=df["state"], timing=True).add_to(m)
+    return m
+
+
+def measure(build, df, path):
+    start = time.perf_counter()
+    html = build(df).get_root().render()
+    elapsed = time.perf_counter() - start
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(html)
+    return elapsed, len(html.encode("utf-8")) / 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--svg-max", type=int, default=100_000,
+                        help="skip the SVG path above this many points")
+    args = parser.parse_args()
+
+    out_dir = tempfile.mkdtemp(prefix="canvas_bench_")
+    print(f"{'points':>8} {'renderer':>8} {'build+render (s)':>17} {'html (MB)':>10}")
+    for n in (10_000, 100_000, 500_000):
+        df = synthetic_points(n)
+        for name, build in (("svg", svg_map), ("canvas", canvas_map)):
+            if name == "svg" and n > args.svg_max:
+                continue
+            elapsed, size = measure(build, df, os.path.join(out_dir, f"{name}_{n}.html"))
+            print(f"{n:>8} {name:>8} {elapsed:>17.2f} {size:>10.1f}")
+    print(f"HTML written to {out_dir}")
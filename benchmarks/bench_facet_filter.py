@@ -0,0 +1,73 @@
+"""
+Micro-benchmark: sidebar filtering on synthetic tickets.
+
+Compares the old per-rerun filter_tickets scan (classify + isin on strings)
+against TicketStore.select, which ORs/ANDs the prebuilt FacetIndex bitsets,
+and times the facet counts shown next to the sidebar checkboxes. Run from
+the repo root:
+
+    python benchmarks/bench_facet_filter.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ticket_utils import BASE_CATEGORIES, TicketStore, filter_tickets  # noqa: E402
+
+STATES = ["เสร็จสิ้น", "กำลังดำเนินการ", "รอรับเรื่อง"]
+DISTRICTS = [f"เขต {i}" for i in range(50)]
+
+
+def synthetic_tickets(n, seed=0):
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2024-01-01").value
+    return pd.DataFrame({
+        "ticket_id": [f"T-{i}" for i in range(n)],
+        "type": ["{" + ",".join(t) + "}" for t in rng.choice(BASE_CATEGORIES, (n, 2))],
+        "state": pd.Categorical(rng.choice(STATES, n)),
+        "district": pd.Categorical(rng.choice(DISTRICTS, n)),
+        "lat": 13.55 + rng.random(n) * 0.4,
+        "lng": 100.35 + rng.random(n) * 0.55,
+        "timestamp": pd.to_datetime(rng.integers(start, start + 365 * 86_400 * 10**9, n)),
+        "duration_minutes_finished": rng.random(n) * 10_000,
+    })
+
+
+def best_of(fn, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(1)
+    districts = list(rng.choice(DISTRICTS, 10, replace=False))
+    categories = list(rng.choice(BASE_CATEGORIES, 5, replace=False))
+    states = STATES[:2]
+
+    print(f"{'rows':>10} {'isin scan (ms)':>15} {'bitsets (ms)':>13} {'counts (ms)':>12} {'build (s)':>10}")
+    for n in (10_000, 100_000, 1_000_000):
+        df = synthetic_tickets(n)
+        start = time.perf_counter()
+        store = TicketStore.from_frame(df)
+        t_build = time.perf_counter() - start
+
+        old = filter_tickets(df, districts, categories, states)
+        new = store.select(districts, categories, states)
+        assert (old.index.to_numpy() == new).all()
+
+        t_old = best_of(lambda: filter_tickets(df, districts, categories, states))
+        t_new = best_of(lambda: store.select(districts, categories, states))
+        t_counts = best_of(lambda: (
+            store.facet_counts("district", categories=categories, states=states),
+            store.facet_counts("type_filtered", districts=districts, states=states),
+        ))
+        print(f"{n:>10} {t_old * 1e3:>15.2f} {t_new * 1e3:>13.3f} {t_counts * 1e3:>12.3f} {t_build:>10.2f}")
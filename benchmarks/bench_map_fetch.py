@@ -0,0 +1,106 @@
+"""
+Benchmark: get_map_data fetch paths against a synthetic Postgres table.
+
+Compares the old RealDictCursor -> DataFrame -> to_numeric/to_datetime path
+with the COPY ... TO STDOUT (CSV) -> read_csv path used by db_utils.copy_frame.
+db_utils reads st.secrets on import, so both paths are restated here against a
+plain psycopg2 connection. Each run happens in a fresh process so peak RSS is
+measured per path. Needs a scratch database; run from the repo root:
+
+    BENCH_PG_DSN="dbname=bench user=postgres" python benchmarks/bench_map_fetch.py
+"""
+import io
+import multiprocessing as mp
+import os
+import resource
+import time
+
+import pandas as pd
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+DSN = os.environ.get("BENCH_PG_DSN", "dbname=postgres")
+TABLE = "bench_map_rows"
+COLUMNS = ["ticket_id", "type", "state", "district", "lng", "lat", "timestamp", "duration_minutes_finished"]
+DTYPES = {"ticket_id": str, "type": "category", "state": "category", "district": "category", "timestamp": str}
+QUERY = f"SELECT {', '.join(COLUMNS)} FROM {TABLE} ORDER BY timestamp DESC LIMIT %s"
+
+
+def create_table(n):
+    with psycopg2.connect(DSN) as conn, conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        cur.execute(f"""
+            CREATE TABLE {TABLE} AS
+            SELECT
+                'T-' || i AS ticket_id,
+                (ARRAY['ถนน', 'แสงสว่าง', 'ทางเท้า', 'น้ำท่วม', 'ความสะอาด'])[1 + i % 5] AS type,
+                (ARRAY['เสร็จสิ้น', 'กำลังดำเนินการ', 'รอรับเรื่อง'])[1 + i % 3] AS state,
+                'เขต ' || (i % 50) AS district,
+                100.35 + random() * 0.55 AS lng,
+                13.55 + random() * 0.40 AS lat,
+                now() - (i || ' minutes')::interval AS timestamp,
+                CASE WHEN i % 3 = 0 THEN (random() * 10000)::int END AS duration_minutes_finished
+            FROM generate_series(1, %s) AS i
+        """, (n,))
+
+
+def drop_table():
+    with psycopg2.connect(DSN) as conn, conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+def fetch_dict_rows(n):
+    with psycopg2.connect(DSN, cursor_factory=RealDictCursor) as conn, conn.cursor() as cur:
+        cur.execute(QUERY, (n,))
+        rows = cur.fetchall()
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    df["lng"] = pd.to_numeric(df["lng"], errors="coerce")
+    df["lat"] = pd.to_numeric(df["lat"], errors="coerce")
+    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
+    return df
+
+
+def fetch_copy(n):
+    buf = io.BytesIO()
+    with psycopg2.connect(DSN) as conn, conn.cursor() as cur:
+        sql = cur.mogrify(QUERY, (n,)).decode("utf-8")
+        cur.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER true)", buf)
+    buf.seek(0)
+    df = pd.read_csv(buf, dtype=DTYPES, keep_default_na=False, na_values=[""], encoding="utf-8")
+    df["lng"] = pd.to_numeric(df["lng"], errors="coerce")
+    df["lat"] = pd.to_numeric(df["lat"], errors="coerce")
+    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce", format="ISO8601")
+    return df
+
+
+def run(name, n, queue):
+    fn = {"dict rows": fetch_dict_rows, "copy csv": fetch_copy}[name]
+    base_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    df = fn(n)
+    elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((elapsed, (peak_kb - base_kb) / 1024, df.memory_usage(deep=True).sum() / 2**20, len(df)))
+
+
+def measure(name, n):
+    queue = mp.Queue()
+    proc = mp.Process(target=run, args=(name, n, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+if __name__ == "__main__":
+    mp.set_start_method("spawn")
+    print(f"{'rows':>10} {'path':>10} {'wall (s)':>9} {'peak RSS (MB)':>14} {'frame (MB)':>11}")
+    try:
+        for n in (100_000, 1_000_000):
+            create_table(n)
+            for name in ("dict rows", "copy csv"):
+                elapsed, peak_mb, frame_mb, rows = measure(name, n)
+                assert rows == n
+                print(f"{n:>10} {name:>10} {elapsed:>9.2f} {peak_mb:>14.1f} {frame_mb:>11.1f}")
+    finally:
+        drop_table()
@@ -0,0 +1,68 @@
+"""
+Micro-benchmark: status chart counts on synthetic tickets.
+
+Compares the old per-(status, label) boolean-mask loop against
+ticket_utils.count_by_bucket. Run from the repo root:
+
+    python benchmarks/bench_status_counts.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ticket_utils import count_by_bucket, time_bucket, x_label_keys  # noqa: E402
+
+STATES = ["เสร็จสิ้น", "กำลังดำเนินการ", "รอรับเรื่อง"]
+X_LABELS = [f"{h}:00" for h in range(24)]
+
+
+def synthetic_tickets(n, seed=0):
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2024-01-01").value
+    return pd.DataFrame({
+        "state": rng.choice(STATES, n),
+        "timestamp": pd.to_datetime(rng.integers(start, start + 86_400 * 10**9, n)),
+    })
+
+
+def mask_loop(df):
+    df_plot = pd.DataFrame({'X': X_LABELS})
+    for status in STATES:
+        counts = []
+        for x in X_LABELS:
+            mask_status = (df['state'] == status) & (df['timestamp'].dt.hour == int(x.split(':')[0]))
+            counts.append(mask_status.sum())
+        df_plot[status] = counts
+    return df_plot
+
+
+def vectorized(df):
+    buckets = time_bucket(df["timestamp"], "hour")
+    return count_by_bucket(buckets, df["state"], x_label_keys("รายวัน", X_LABELS), STATES)
+
+
+def best_of(fn, df, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(df)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    print(f"{'rows':>10} {'mask loop (s)':>14} {'groupby (s)':>12} {'speedup':>8}")
+    for n in (10_000, 100_000, 1_000_000):
+        df = synthetic_tickets(n)
+        old = mask_loop(df)
+        new = vectorized(df)
+        assert (old[STATES].values == new[STATES].values).all()
+
+        t_old = best_of(mask_loop, df)
+        t_new = best_of(vectorized, df)
+        print(f"{n:>10} {t_old:>14.3f} {t_new:>12.3f} {t_old / t_new:>7.1f}x")
@@ -1,7 +1,19 @@
+import collections
+import datetime
+import functools
+import io
+import os
+import threading
+import time
+from contextlib import contextmanager
+
 import streamlit as st
 import pandas as pd
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import PoolError
+
+from ticket_utils import TicketStore
 
 MAPBOX_API_KEY = st.secrets["MAPBOX_API_KEY"]
 PG_HOST = st.secrets.get("PG_HOST", "localhost")
@@ -12,9 +24,129 @@ PG_PASS = st.secrets.get("PG_PASS")
 PG_SSL  = st.secrets.get("PG_SSLMODE")  
 SNAPSHOT_BASE = st.secrets.get("SNAPSHOT_BASE", "http://127.0.0.1:9000/snapshot")
 
+PG_POOL_MIN = int(st.secrets.get("PG_POOL_MIN", 2))
+PG_POOL_MAX = int(st.secrets.get("PG_POOL_MAX", 10))
+PG_POOL_TIMEOUT = float(st.secrets.get("PG_POOL_TIMEOUT", 10))
+PG_POOL_MAX_IDLE = float(st.secrets.get("PG_POOL_MAX_IDLE", 300))
+PG_POOL_HEALTH_CHECK = 30
+MAP_STREAM_ITERSIZE = 50000
+# NULL marker for COPY ... CSV output; a text value equal to it also reads back as NaN
+COPY_NULL = r"\N"
+# merge deltas a TicketSync keeps for aggregates still on an older version
+TICKET_SYNC_HISTORY = 16
 
 
-def get_conn():
+class ConnectionPool:
+    """
+    Bounded pool of psycopg2 connections that blocks (up to a timeout) instead
+    of raising when exhausted. Returned connections stay open in an idle list
+    (up to maxconn of them), so only a new peak in concurrency pays for the
+    connect/SSL handshake. Idle connections are pinged after PG_POOL_HEALTH_CHECK
+    seconds and closed after max_idle; checkout wait times are recorded.
+    minconn connections are opened up front.
+    """
+
+    def __init__(self, minconn, maxconn, max_idle, **connect_kwargs):
+        self._connect_kwargs = connect_kwargs
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        # (conn, returned_at); the most recently returned is reused first
+        self._idle = [(self._connect(), time.monotonic()) for _ in range(minconn)]
+        self.maxconn = maxconn
+        self.max_idle = max_idle
+        self.stats = {
+            "checkouts": 0,
+            "in_use": 0,
+            "wait_total_s": 0.0,
+            "wait_max_s": 0.0,
+            "timeouts": 0,
+            "recycled": 0,
+        }
+
+    def _connect(self):
+        return psycopg2.connect(**self._connect_kwargs)
+
+    def getconn(self, timeout):
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=timeout):
+            with self._lock:
+                self.stats["timeouts"] += 1
+            raise PoolError(f"no database connection available after {timeout}s")
+        waited = time.monotonic() - start
+
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self.stats["checkouts"] += 1
+            self.stats["in_use"] += 1
+            self.stats["wait_total_s"] += waited
+            self.stats["wait_max_s"] = max(self.stats["wait_max_s"], waited)
+        return conn
+
+    def putconn(self, conn):
+        try:
+            with self._lock:
+                self.stats["in_use"] -= 1
+            if not conn.closed:
+                try:
+                    status = conn.info.transaction_status
+                    if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                        # server connection lost
+                        conn.close()
+                    elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                except psycopg2.Error:
+                    conn.close()
+
+            expired = []
+            with self._lock:
+                if not conn.closed:
+                    self._idle.append((conn, time.monotonic()))
+                # the oldest entries are the ones a busy pool never gets back to
+                now = time.monotonic()
+                while self._idle and now - self._idle[0][1] > self.max_idle:
+                    expired.append(self._idle.pop(0)[0])
+                self.stats["recycled"] += len(expired)
+            for old in expired:
+                old.close()
+        finally:
+            self._slots.release()
+
+    def _checkout(self):
+        """
+        The most recently returned idle connection that passes the health
+        check, else a new connection.
+        """
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, returned_at = self._idle.pop()
+            if self._healthy(conn, time.monotonic() - returned_at):
+                return conn
+            with self._lock:
+                self.stats["recycled"] += 1
+            conn.close()
+        return self._connect()
+
+    def _healthy(self, conn, idle):
+        healthy = not conn.closed and idle <= self.max_idle
+        if healthy and idle > PG_POOL_HEALTH_CHECK:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                healthy = False
+        return healthy
+
+
+@st.cache_resource
+def get_pool():
     sslmode = PG_SSL
     if PG_HOST in ("localhost", "127.0.0.1"):
         sslmode = sslmode or "disable"
@@ -25,7 +157,10 @@ def get_conn():
         st.error("Missing DB secrets. Check .streamlit/secrets.toml")
         st.stop()
 
-    return psycopg2.connect(
+    return ConnectionPool(
+        PG_POOL_MIN,
+        PG_POOL_MAX,
+        PG_POOL_MAX_IDLE,
         host=PG_HOST,
         port=PG_PORT,
         dbname=PG_DB,
@@ -34,9 +169,120 @@ def get_conn():
         sslmode=sslmode,
         cursor_factory=RealDictCursor
     )
-    
-@st.cache_data
-def get_map_data(limit=1000, start_date=None, end_date=None) -> pd.DataFrame:
+
+
+@contextmanager
+def get_conn():
+    """
+    Borrow a pooled connection; commits on success, rolls back on error
+    and always returns the connection to the pool.
+    """
+    pool = get_pool()
+    conn = pool.getconn(PG_POOL_TIMEOUT)
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def get_pool_metrics():
+    """
+    Checkout statistics of the process-wide pool.
+    Returns: Dict with checkouts, in_use, avg/max wait, timeouts, recycled
+    """
+    pool = get_pool()
+    with pool._lock:
+        stats = dict(pool.stats)
+    stats["max_size"] = pool.maxconn
+    stats["wait_avg_s"] = stats["wait_total_s"] / stats["checkouts"] if stats["checkouts"] else 0.0
+    return stats
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def get_data_version():
+    """
+    Latest data_version in traffy_tickets, re-checked at most once a minute.
+    Caches keyed on this value refresh exactly when new data lands.
+    """
+    with get_conn() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT MAX(data_version) AS data_version FROM traffy_tickets;")
+        row = cursor.fetchone()
+    return row["data_version"] if row else None
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def table_version(table):
+    """
+    Change token for tables without a data_version column: the table's
+    insert/update/delete counters from pg_stat_user_tables, re-checked at most once a minute.
+    """
+    with get_conn() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT n_tup_ins + n_tup_upd + n_tup_del AS changes
+            FROM pg_stat_user_tables
+            WHERE relname = %s;
+        """, (table,))
+        row = cursor.fetchone()
+    return row["changes"] if row else None
+
+
+def cached_query(ttl=None, version=None, **cache_kwargs):
+    """
+    st.cache_data for a db_utils reader with a per-function TTL.
+    version is a zero-argument function returning a change token (e.g.
+    get_data_version); the token is part of the cache key, so results refresh
+    when new data lands and the TTL only bounds how long an entry lives.
+    """
+    cache_kwargs.setdefault("show_spinner", False)
+
+    def decorator(func):
+        # not underscore-prefixed: st.cache_data leaves _args out of the key
+        def versioned(data_version, *args, **kwargs):
+            return func(*args, **kwargs)
+
+        # st.cache_data tells functions apart by module and qualname
+        versioned.__module__ = func.__module__
+        versioned.__name__ = func.__name__
+        versioned.__qualname__ = func.__qualname__
+        cached = st.cache_data(ttl=ttl, **cache_kwargs)(versioned)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return cached(version() if version else None, *args, **kwargs)
+
+        wrapper.clear = cached.clear
+        return wrapper
+
+    return decorator
+
+
+def date_range_clause(column, start_date=None, end_date=None):
+    """
+    Half-open timestamp range on column (>= start, < end + 1 day) instead of
+    casting column::date, so a btree index on column stays usable.
+    Returns: (sql fragment starting with " AND", params list)
+    """
+    sql = ""
+    params = []
+    if start_date:
+        sql += f" AND {column} >= %s"
+        params.append(start_date)
+    if end_date:
+        sql += f" AND {column} < %s"
+        params.append(end_date + datetime.timedelta(days=1))
+    return sql, params
+
+
+def map_data_query(limit=1000, start_date=None, end_date=None, since_version=None,
+                   before=None, exclude_ids=()):
     query = """
         SELECT
             mv.ticket_id,
@@ -47,14 +293,7 @@ def get_map_data(limit=1000, start_date=None, end_date=None) -> pd.DataFrame:
             mv.lat,
             mv.timestamp,
 
-            t.comment,
-            t.organization,
-            t.subdistrict,
-            t.organization_action,
-            t.photo,
-            t.duration_minutes_inprogress,
-            t.duration_minutes_finished,
-            t.duration_minutes_total
+            t.duration_minutes_finished
 
         FROM traffy_map_view mv
         LEFT JOIN traffy_tickets t
@@ -62,41 +301,171 @@ def get_map_data(limit=1000, start_date=None, end_date=None) -> pd.DataFrame:
         WHERE mv.lng IS NOT NULL AND mv.lat IS NOT NULL
     """
 
-    params = []
-    if start_date:
-        query += " AND mv.timestamp::date >= %s"
-        params.append(start_date)
-    if end_date:
-        query += " AND mv.timestamp::date <= %s"
-        params.append(end_date)
+    range_sql, params = date_range_clause("mv.timestamp", start_date, end_date)
+    query += range_sql
+    # rows written by ingestion runs after since_version (new tickets and updated states)
+    if since_version is not None:
+        query += " AND t.data_version > %s"
+        params.append(since_version)
+    # rows older than a TicketSync window: before its oldest timestamp, plus the
+    # ties at that timestamp the window left out
+    if before is not None:
+        query += " AND (mv.timestamp < %s OR (mv.timestamp = %s AND NOT mv.ticket_id::text = ANY(%s::text[])))"
+        params += [before, before, list(exclude_ids)]
+    # limit=None returns every row unsorted, for streamed aggregation
+    if limit is not None:
+        query += " ORDER BY mv.timestamp DESC LIMIT %s"
+        params.append(limit)
 
-    query += " ORDER BY mv.timestamp DESC LIMIT %s"
-    params.append(limit)
+    return query, params
 
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(query, tuple(params))
-        rows = cur.fetchall()
 
-    df = pd.DataFrame(rows, columns=[
-        "ticket_id", "type", "state", "district",
-        "lng", "lat", "timestamp",
-        "comment", "organization", "subdistrict",
-        "organization_action", "photo",
-        "duration_minutes_inprogress", "duration_minutes_finished", "duration_minutes_total"
-    ])
+# text columns (comment, photo, ...) are fetched per ticket through get_ticket
+MAP_DATA_COLUMNS = [
+    "ticket_id", "type", "state", "district",
+    "lng", "lat", "timestamp",
+    "duration_minutes_finished"
+]
+# repeated labels are stored once per category
+MAP_DATA_DTYPES = {
+    "ticket_id": str,
+    "type": "category",
+    "state": "category",
+    "district": "category",
+    "timestamp": str,
+}
+
+
+def copy_frame(query, params=(), dtype=None):
+    """
+    Run query through COPY ... TO STDOUT (CSV) and parse it with pandas' C
+    reader, so no Python object is created per row (unlike RealDictCursor).
+    SQL NULL is written as COPY_NULL and only that becomes NaN; pandas cannot
+    tell a quoted empty string from an unquoted one, so '' stays ''.
+    Returns: DataFrame with one column per selected field
+    """
+    buf = io.BytesIO()
+    with get_conn() as conn, conn.cursor() as cursor:
+        sql = cursor.mogrify(query, tuple(params)).decode("utf-8").strip().rstrip(";")
+        cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER true, NULL '{COPY_NULL}')", buf)
+
+    buf.seek(0)
+    return pd.read_csv(buf, dtype=dtype, keep_default_na=False, na_values=[COPY_NULL], encoding="utf-8")
+
+
+def read_map_data(limit=1000, start_date=None, end_date=None, since_version=None) -> pd.DataFrame:
+    """
+    Uncached get_map_data; since_version keeps only rows written after it.
+    """
+    query, params = map_data_query(limit, start_date, end_date, since_version)
+    df = copy_frame(query, params, dtype=MAP_DATA_DTYPES)
 
     if df.empty:
         return df
 
+    # no-ops when COPY already yielded floats; coerces stray text otherwise
     df["lng"] = pd.to_numeric(df["lng"], errors="coerce")
     df["lat"] = pd.to_numeric(df["lat"], errors="coerce")
-    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
+    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce", format="ISO8601")
     df = df.dropna(subset=["lng", "lat", "timestamp"])
 
     return df
 
 
-@st.cache_data(ttl=20)
+@cached_query(ttl=3600, version=get_data_version)
+def get_map_data(limit=1000, start_date=None, end_date=None) -> pd.DataFrame:
+    return read_map_data(limit, start_date, end_date)
+
+
+class TicketSync:
+    """
+    Process-wide TicketStore of the limit most recent tickets in a date range.
+    refresh() reads only the rows written after the last data_version seen and
+    merges them by ticket_id, so its cost follows the rate of new complaints,
+    not the table size. The last TICKET_SYNC_HISTORY merge deltas are kept for
+    aggregates that catch up from an earlier version.
+    """
+
+    def __init__(self, limit, start_date=None, end_date=None):
+        self.limit = limit
+        self.start_date = start_date
+        self.end_date = end_date
+        self.lock = threading.Lock()
+        self.store = None
+        self.version = None
+        self.deltas = collections.deque(maxlen=TICKET_SYNC_HISTORY)
+
+    def refresh(self):
+        """
+        Returns: the current TicketStore
+        """
+        # read before the rows: rows written meanwhile are read again next
+        # time, which merging by ticket_id makes harmless
+        version = get_data_version()
+        with self.lock:
+            if self.store is not None and version == self.version:
+                return self.store
+
+            if self.store is None or self.version is None or len(self.store) == 0:
+                self.store = TicketStore.from_frame(read_map_data(self.limit, self.start_date, self.end_date))
+                self.deltas.clear()
+            else:
+                changes = read_map_data(None, self.start_date, self.end_date, since_version=self.version)
+                self.store, delta = self.store.merge(changes, self.limit)
+                delta["from_version"] = self.version
+                self.deltas.append(delta)
+            self.version = version
+            return self.store
+
+    def since(self, version):
+        """
+        Deltas that bring aggregates built at version up to the current store.
+        Returns: (store, version, deltas); deltas is None when they no longer
+        reach back to version and the aggregates have to be rebuilt
+        """
+        with self.lock:
+            if version == self.version:
+                return self.store, self.version, []
+            starts = [i for i, delta in enumerate(self.deltas) if delta["from_version"] == version]
+            deltas = list(self.deltas)[starts[0]:] if starts else None
+            return self.store, self.version, deltas
+
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def get_ticket_sync(limit=1000, start_date=None, end_date=None) -> TicketSync:
+    """
+    One TicketSync per window, shared by every session; call refresh() for
+    its current TicketStore.
+    """
+    return TicketSync(limit, start_date, end_date)
+
+
+def iter_map_data(start_date=None, end_date=None, itersize=MAP_STREAM_ITERSIZE, before=None, exclude_ids=()):
+    """
+    Every ticket in the range, without get_map_data's row limit, as DataFrame
+    chunks of at most itersize rows read from a server-side (named) cursor.
+    Memory stays bounded by the chunk size; feed the chunks to incremental
+    aggregators (ticket_utils.TicketCube, map_utils.GroupedHeatGrids).
+    before/exclude_ids restrict it to the tickets older than a TicketSync window.
+    """
+    query, params = map_data_query(None, start_date, end_date, before=before, exclude_ids=exclude_ids)
+    with get_conn() as conn, conn.cursor(name="map_data_stream", cursor_factory=psycopg2.extensions.cursor) as cursor:
+        cursor.itersize = itersize
+        cursor.execute(query, tuple(params))
+        while True:
+            rows = cursor.fetchmany(itersize)
+            if not rows:
+                break
+
+            chunk = pd.DataFrame(rows, columns=MAP_DATA_COLUMNS)
+            chunk["lng"] = pd.to_numeric(chunk["lng"], errors="coerce")
+            chunk["lat"] = pd.to_numeric(chunk["lat"], errors="coerce")
+            chunk["timestamp"] = pd.to_datetime(chunk["timestamp"], errors="coerce")
+            chunk["duration_minutes_finished"] = pd.to_numeric(chunk["duration_minutes_finished"], errors="coerce")
+            yield chunk.dropna(subset=["lng", "lat", "timestamp"])
+
+
+@cached_query(ttl=20)
 def load_cctv_df() -> pd.DataFrame:
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute("""
@@ -116,53 +485,98 @@ def load_cctv_df() -> pd.DataFrame:
     df = df.dropna(subset=["lat", "lng"])
     return df
 
+OVERVIEW_QUERY = """
+    SELECT
+        COUNT(*) AS total,
+        COUNT(*) FILTER (WHERE state = 'เสร็จสิ้น') AS finished,
+        COUNT(*) FILTER (WHERE state = 'กำลังดำเนินการ') AS inprogress,
+        AVG(duration_minutes_finished) FILTER (WHERE duration_minutes_finished > 0) AS avg_duration,
+        MAX(data_version) AS last_update
+    FROM traffy_tickets
+"""
+
+USE_OVERVIEW_SUMMARY = bool(st.secrets.get("PG_OVERVIEW_SUMMARY", False))
+
+
 def get_dashboard_overview():
     """
     Get overview statistics for dashboard header
     Returns: Dict with key metrics
     """
-    conn = get_conn()
-    cursor = conn.cursor()
+    return load_dashboard_overview(get_data_version())
 
-    def fetch_one_value(query):
-        cursor.execute(query)
-        result = cursor.fetchone()
-        if result is None:
-            return 0
-        # ถ้า result เป็น tuple
-        if isinstance(result, tuple):
-            return result[0] if result[0] is not None else 0
-        # ถ้า result เป็น dict
-        if isinstance(result, dict):
-            return next(iter(result.values()), 0)
-        return 0
-
-    total = fetch_one_value("SELECT COUNT(*) FROM traffy_tickets;")
-    finished = fetch_one_value("SELECT COUNT(*) FROM traffy_tickets WHERE state = 'เสร็จสิ้น';")
-    inprogress = fetch_one_value("SELECT COUNT(*) FROM traffy_tickets WHERE state = 'กำลังดำเนินการ';")
-    avg_duration = fetch_one_value("""
-        SELECT AVG(duration_minutes_finished)
-        FROM traffy_tickets
-        WHERE duration_minutes_finished > 0;
-    """)
-    last_update = fetch_one_value("SELECT MAX(data_version) FROM traffy_tickets;")
 
-    cursor.close()
-    conn.close()
+@st.cache_data(max_entries=4, show_spinner=False)
+def load_dashboard_overview(data_version):
+    with get_conn() as conn, conn.cursor() as cursor:
+        if USE_OVERVIEW_SUMMARY:
+            row = refresh_overview_summary(cursor, data_version)
+        else:
+            cursor.execute(OVERVIEW_QUERY)
+            row = cursor.fetchone()
+
+    total = row["total"] or 0
+    finished = row["finished"] or 0
+    avg_duration = row["avg_duration"]
+    last_update = row["last_update"]
 
     return {
         'total_tickets': total,
         'finished_tickets': finished,
-        'inprogress_tickets': inprogress,
+        'inprogress_tickets': row["inprogress"] or 0,
         'completion_rate': round((finished / total * 100) if total > 0 else 0, 2),
         'avg_completion_hours': round(float(avg_duration) / 60, 1) if avg_duration else 0,
         'last_updated': last_update.isoformat() if last_update else None
     }
 
-def get_bma_news(limit=50, start_date=None, end_date=None):
-    conn = get_conn()
-    cursor = conn.cursor()
 
+def refresh_overview_summary(cursor, data_version):
+    """
+    Read the one-row traffy_overview_summary table, rebuilding it first when
+    its last_update is behind data_version. Every process and restart shares
+    the stored row, so the full scan runs once per data_version.
+    """
+    # Deliberately a full rebuild rather than an upsert of the rows above the
+    # stored last_update: an updated ticket is rewritten with the new
+    # data_version, and adding its new state without its old one (which is
+    # gone by then) would double-count it in total and drift finished/inprogress.
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS traffy_overview_summary AS {OVERVIEW_QUERY} WITH NO DATA;")
+    cursor.execute("SELECT * FROM traffy_overview_summary LIMIT 1;")
+    row = cursor.fetchone()
+    if row is not None and row["last_update"] == data_version:
+        return row
+
+    cursor.execute("LOCK TABLE traffy_overview_summary IN EXCLUSIVE MODE;")
+    cursor.execute("SELECT * FROM traffy_overview_summary LIMIT 1;")
+    row = cursor.fetchone()
+    if row is None or row["last_update"] != data_version:
+        cursor.execute("DELETE FROM traffy_overview_summary;")
+        cursor.execute(f"INSERT INTO traffy_overview_summary {OVERVIEW_QUERY};")
+        cursor.execute("SELECT * FROM traffy_overview_summary LIMIT 1;")
+        row = cursor.fetchone()
+    return row
+
+
+class LazyQuery:
+    """
+    Deferred call of a query function with fixed params.
+    The query runs on the first get() only, so unused layer data is never fetched.
+    """
+
+    def __init__(self, func, **params):
+        self.func = func
+        self.params = params
+        self._loaded = False
+        self._value = None
+
+    def get(self):
+        if not self._loaded:
+            self._value = self.func(**self.params)
+            self._loaded = True
+        return self._value
+
+@cached_query(ttl=300, version=functools.partial(table_version, "bma_news"))
+def get_bma_news(limit=50, start_date=None, end_date=None):
     query = """
     SELECT id, title, description, news_date, lat, lng, source
     FROM bma_news
@@ -184,11 +598,9 @@ def get_bma_news(limit=50, start_date=None, end_date=None):
         query += " LIMIT %s"
         params.append(limit)
 
-    cursor.execute(query, tuple(params))
-    rows = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
+    with get_conn() as conn, conn.cursor() as cursor:
+        cursor.execute(query, tuple(params))
+        rows = cursor.fetchall()
 
     news_list = []
     for row in rows:
@@ -204,10 +616,8 @@ def get_bma_news(limit=50, start_date=None, end_date=None):
 
     return news_list
 
+@cached_query(ttl=86400, version=functools.partial(table_version, "police_stations"))
 def get_police_stations(limit=1000):
-    conn = get_conn()
-    cursor = conn.cursor()
-
     query = """
     SELECT id_police, name, address, tel, dcode, division, lat, lng, created_at, updated_at
     FROM police_stations
@@ -219,11 +629,9 @@ def get_police_stations(limit=1000):
         query += " LIMIT %s"
         params.append(limit)
 
-    cursor.execute(query, tuple(params))
-    rows = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
+    with get_conn() as conn, conn.cursor() as cursor:
+        cursor.execute(query, tuple(params))
+        rows = cursor.fetchall()
 
     police_list = []
     for row in rows:
@@ -242,10 +650,8 @@ def get_police_stations(limit=1000):
 
     return police_list
 
+@cached_query(ttl=86400, version=functools.partial(table_version, "bangkok_population"))
 def get_bangkok_population(limit=None):
-    conn = get_conn()
-    cursor = conn.cursor()
-    
     query = """
     SELECT district_no, district_name, total_population, male_population, 
            female_population, created_at, updated_at
@@ -257,11 +663,9 @@ def get_bangkok_population(limit=None):
         query += " LIMIT %s"
         params.append(limit)
 
-    cursor.execute(query, tuple(params))
-    rows = cursor.fetchall()
-    
-    cursor.close()
-    conn.close()
+    with get_conn() as conn, conn.cursor() as cursor:
+        cursor.execute(query, tuple(params))
+        rows = cursor.fetchall()
 
     population_list = []
     for row in rows:
@@ -277,10 +681,8 @@ def get_bangkok_population(limit=None):
 
     return population_list
 
+@cached_query(ttl=300, version=functools.partial(table_version, "bma_events"))
 def get_bma_events(start_date=None, end_date=None):
-    conn = get_conn()
-    cursor = conn.cursor()
-
     query = """
         SELECT id, title_th, title_en, desc_th, desc_en,
                lat, lng, icon, start_date, start_time, end_date, status
@@ -304,11 +706,9 @@ def get_bma_events(start_date=None, end_date=None):
 
     query += " ORDER BY start_date DESC"
 
-    cursor.execute(query, tuple(params))
-    rows = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
+    with get_conn() as conn, conn.cursor() as cursor:
+        cursor.execute(query, tuple(params))
+        rows = cursor.fetchall()
 
     return [
         {
@@ -329,14 +729,12 @@ def get_bma_events(start_date=None, end_date=None):
     ]
 
 
+@cached_query(ttl=3600, version=get_data_version)
 def get_type_summary(limit=20):
     """
     Get complaint type breakdown for pie/bar chart
     Returns: List of {type, total, finished, avg_duration, completion_rate}
     """
-    conn = get_conn()
-    cursor = conn.cursor()
-
     query = f"""
     SELECT
         type,
@@ -349,11 +747,9 @@ def get_type_summary(limit=20):
     LIMIT {limit};
     """
 
-    cursor.execute(query)
-    rows = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
+    with get_conn() as conn, conn.cursor() as cursor:
+        cursor.execute(query)
+        rows = cursor.fetchall()
 
     type_summary = []
     for row in rows:
@@ -379,6 +775,7 @@ def get_type_summary(limit=20):
 
     return type_summary
 
+@cached_query(ttl=3600, version=get_data_version, max_entries=1000)
 def get_ticket(ticket_id):
     query = """
         SELECT
@@ -415,14 +812,32 @@ def get_ticket(ticket_id):
     }
     
 
+@cached_query(ttl=3600, version=get_data_version)
 def get_district_summary(start_date=None, end_date=None):
     """
     Get district-level statistics for map/heatmap filtered by start_date and end_date.
     Returns: List of dict: {district, total, finished, avg_duration, completion_rate}
     """
-    conn = get_conn()
-    cursor = conn.cursor()
+    query, params = district_summary_query(start_date, end_date)
+
+    with get_conn() as conn, conn.cursor() as cursor:
+        cursor.execute(query, tuple(params))
+        rows = cursor.fetchall()
+
+    district_summary = []
+    for row in rows:
+        district_summary.append({
+            'district': row.get('district', ''),
+            'total': row.get('total', 0),
+            'finished': row.get('finished', 0),
+            'avg_duration': float(row.get('avg_duration', 0)) if row.get('avg_duration') else 0,
+            'completion_rate': round((row.get('finished', 0) / row.get('total', 1) * 100), 2) if row.get('total', 0) > 0 else 0
+        })
+
+    return district_summary
+
 
+def district_summary_query(start_date=None, end_date=None):
     query = """
     SELECT
         district,
@@ -432,31 +847,122 @@ def get_district_summary(start_date=None, end_date=None):
     FROM traffy_tickets
     WHERE 1=1
     """
-    params = []
+    range_sql, params = date_range_clause("timestamp", start_date, end_date)
+    query += range_sql + " GROUP BY district ORDER BY total DESC;"
 
-    if start_date is not None:
-        query += " AND timestamp::date >= %s"
-        params.append(start_date)
-    if end_date is not None:
-        query += " AND timestamp::date <= %s"
-        params.append(end_date)
+    return query, params
 
-    query += " GROUP BY district ORDER BY total DESC;"
 
-    cursor.execute(query, tuple(params))
-    rows = cursor.fetchall()
+TIME_BUCKETS = {
+    "hour": "EXTRACT(HOUR FROM mv.timestamp)",
+    "day": "EXTRACT(DAY FROM mv.timestamp)",
+    "month": "EXTRACT(MONTH FROM mv.timestamp)",
+    "year": "EXTRACT(YEAR FROM mv.timestamp)",
+}
 
-    cursor.close()
-    conn.close()
 
-    district_summary = []
-    for row in rows:
-        district_summary.append({
-            'district': row.get('district', ''),
-            'total': row.get('total', 0),
-            'finished': row.get('finished', 0),
-            'avg_duration': float(row.get('avg_duration', 0)) if row.get('avg_duration') else 0,
-            'completion_rate': round((row.get('finished', 0) / row.get('total', 1) * 100), 2) if row.get('total', 0) > 0 else 0
-        })
+def category_case(column, category_order, fallback="อื่น ๆ"):
+    """
+    SQL CASE mapping column to the first category (in category_order) it contains,
+    the same precedence as the app's per-row map_type.
+    Returns: (sql expression, params list)
+    """
+    sql = f"CASE WHEN {column} IS NULL OR btrim({column}) = '' THEN %s"
+    params = [fallback]
+    for cat in category_order:
+        sql += f" WHEN strpos({column}, %s) > 0 THEN %s"
+        params += [cat.strip(), cat]
+    sql += " ELSE %s END"
+    params.append(fallback)
+    return sql, params
+
+
+@cached_query(ttl=3600, version=get_data_version)
+def get_status_time_series(bucket, start_date=None, end_date=None, districts=(), categories=(), states=(), category_order=()):
+    """
+    Ticket counts pre-bucketed in Postgres for the status chart.
+    bucket: "hour" | "day" | "month" | "year"
+    Returns: DataFrame [bucket, state, district, category, count]
+    """
+    category_sql, category_params = category_case("mv.type", category_order)
+    range_sql, range_params = date_range_clause("mv.timestamp", start_date, end_date)
 
-    return district_summary
+    query = f"""
+        SELECT bucket, state, district, category, COUNT(*) AS count
+        FROM (
+            SELECT
+                {TIME_BUCKETS[bucket]}::int AS bucket,
+                mv.state,
+                mv.district,
+                {category_sql} AS category
+            FROM traffy_map_view mv
+            WHERE mv.lng IS NOT NULL AND mv.lat IS NOT NULL
+            {range_sql}
+            AND mv.district = ANY(%s)
+            AND mv.state = ANY(%s)
+        ) t
+        WHERE category = ANY(%s)
+        GROUP BY bucket, state, district, category
+    """
+    params = category_params + range_params + [list(districts), list(states), list(categories)]
+
+    with get_conn() as conn, conn.cursor() as cursor:
+        cursor.execute(query, tuple(params))
+        rows = cursor.fetchall()
+
+    return pd.DataFrame(rows, columns=["bucket", "state", "district", "category", "count"])
+
+
+INDEX_MIGRATION = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sql", "001_ticket_indexes.sql")
+
+
+def create_ticket_indexes():
+    """
+    Apply sql/001_ticket_indexes.sql (idempotent). When traffy_map_view is a
+    materialized view, the same timestamp/ticket_id indexes are created on it too.
+    """
+    with open(INDEX_MIGRATION, encoding="utf-8") as f:
+        migration = f.read()
+
+    with get_conn() as conn, conn.cursor() as cursor:
+        cursor.execute(migration)
+        cursor.execute("SELECT 1 FROM pg_matviews WHERE matviewname = 'traffy_map_view';")
+        if cursor.fetchone():
+            cursor.execute("CREATE INDEX IF NOT EXISTS traffy_map_view_timestamp_idx ON traffy_map_view (timestamp);")
+            cursor.execute("CREATE INDEX IF NOT EXISTS traffy_map_view_ticket_id_idx ON traffy_map_view (ticket_id);")
+
+
+def plan_scans(plan):
+    """
+    Flatten an EXPLAIN (FORMAT JSON) plan into [(node type, relation, index)].
+    """
+    scans = []
+    if "Scan" in plan.get("Node Type", ""):
+        scans.append((plan["Node Type"], plan.get("Relation Name"), plan.get("Index Name")))
+    for child in plan.get("Plans", []):
+        scans.extend(plan_scans(child))
+    return scans
+
+
+def check_index_usage(start_date=None, end_date=None, limit=1000):
+    """
+    EXPLAIN the map and district-summary queries for a date range.
+    Returns: Dict {query name: {uses_index, indexes, seq_scans}}
+    """
+    queries = {
+        "map_data": map_data_query(limit, start_date, end_date),
+        "district_summary": district_summary_query(start_date, end_date),
+    }
+
+    report = {}
+    with get_conn() as conn, conn.cursor() as cursor:
+        for name, (query, params) in queries.items():
+            cursor.execute("EXPLAIN (FORMAT JSON) " + query.rstrip().rstrip(";"), tuple(params))
+            plan = cursor.fetchone()["QUERY PLAN"][0]["Plan"]
+            scans = plan_scans(plan)
+            report[name] = {
+                "uses_index": any(index for _, _, index in scans),
+                "indexes": sorted({index for _, _, index in scans if index}),
+                "seq_scans": sorted({rel for node, rel, _ in scans if node == "Seq Scan" and rel}),
+            }
+    return report
@@ -0,0 +1,586 @@
+import hashlib
+import json
+import os
+import time
+
+import folium
+import numpy as np
+import pandas as pd
+import requests
+from branca.element import MacroElement
+from jinja2 import Template
+
+# streamlit-folium bounds format; roughly the Bangkok metropolitan area
+BANGKOK_BOUNDS = {
+    "_southWest": {"lat": 13.49, "lng": 100.32},
+    "_northEast": {"lat": 13.96, "lng": 100.94},
+}
+
+
+def in_bounds(df, bounds, pad=0.2, lat_col="lat", lng_col="lng"):
+    """
+    Boolean mask of rows inside bounds, padded by a fraction of the view size
+    so small pans do not immediately drop markers at the edges.
+    """
+    south, west = bounds["_southWest"]["lat"], bounds["_southWest"]["lng"]
+    north, east = bounds["_northEast"]["lat"], bounds["_northEast"]["lng"]
+    dlat = (north - south) * pad
+    dlng = (east - west) * pad
+
+    lat = df[lat_col].to_numpy()
+    lng = df[lng_col].to_numpy()
+    return (
+        (lat >= south - dlat) & (lat <= north + dlat)
+        & (lng >= west - dlng) & (lng <= east + dlng)
+    )
+
+
+def viewport_rows(df, bounds, limit, lat_col="lat", lng_col="lng"):
+    """
+    Rows inside the current view, capped at limit so the marker payload stays
+    constant no matter how many tickets are in the date range.
+    """
+    if df.empty:
+        return df
+    return df[in_bounds(df, bounds, lat_col=lat_col, lng_col=lng_col)].head(limit)
+
+
+def nearest_row(df, lat, lng, max_dist=1e-4, lat_col="lat", lng_col="lng"):
+    """
+    Index label of the row at a clicked marker position, or None when the
+    click (e.g. on another layer's marker) is farther than max_dist degrees.
+    """
+    if df.empty:
+        return None
+    dist = (df[lat_col].to_numpy() - lat) ** 2 + (df[lng_col].to_numpy() - lng) ** 2
+    i = int(np.argmin(dist))
+    return df.index[i] if dist[i] <= max_dist ** 2 else None
+
+
+class CanvasPoints(MacroElement):
+    """
+    Draw a large point set on one shared L.canvas renderer instead of one SVG
+    node per marker. Points are shipped once as a flat [lat, lng, color, ...]
+    array; a popup is built from labels only when a point is clicked.
+    timing=True logs the client-side draw time with console.debug (benchmarks only).
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            {% if this.timing %}var t0 = performance.now();{% endif %}
+            var renderer = L.canvas({padding: 0.5});
+            var colors = {{ this.colors|tojson }};
+            var labels = {{ this.labels|tojson }};
+            var pts = {{ this.points|tojson }};
+            var layer = L.featureGroup();
+            for (var i = 0, n = 0; i < pts.length; i += 3, n++) {
+                var color = colors[pts[i + 2]];
+                layer.addLayer(L.circleMarker([pts[i], pts[i + 1]], {
+                    renderer: renderer,
+                    radius: {{ this.radius }},
+                    color: color,
+                    fillColor: color,
+                    fillOpacity: {{ this.fill_opacity }},
+                    weight: 1,
+                    idx: n
+                }));
+            }
+            if (labels) {
+                layer.on("click", function(e) {
+                    L.popup({maxWidth: 300})
+                        .setLatLng(e.latlng)
+                        .setContent(labels[e.layer.options.idx])
+                        .openOn(layer._map);
+                });
+            }
+            layer.addTo({{ this._parent.get_name() }});
+            {% if this.timing %}
+            console.debug("{{ this.get_name() }}: " + n + " points in " + (performance.now() - t0).toFixed(0) + " ms");
+            {% endif %}
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, lats, lngs, color_idx, colors, labels=None, radius=6, fill_opacity=0.7, timing=False):
+        super().__init__()
+        self._name = "CanvasPoints"
+        self.points = np.column_stack([
+            np.round(np.asarray(lats, dtype=float), 5),
+            np.round(np.asarray(lngs, dtype=float), 5),
+            np.asarray(color_idx, dtype=int),
+        ]).ravel().tolist()
+        self.colors = list(colors)
+        self.labels = list(labels) if labels is not None else None
+        self.radius = radius
+        self.fill_opacity = fill_opacity
+        self.timing = timing
+
+
+def canvas_points(df, color_col, color_map, default_color="#999999", labels=None,
+                  lat_col="lat", lng_col="lng", **kwargs):
+    """
+    CanvasPoints for a DataFrame, coloring each row by color_map[row[color_col]].
+    """
+    colors = list(color_map.values()) + [default_color]
+    index = {key: i for i, key in enumerate(color_map)}
+    color_idx = df[color_col].astype(object).map(index).fillna(len(colors) - 1).astype(int)
+    return CanvasPoints(df[lat_col], df[lng_col], color_idx, colors, labels=labels, **kwargs)
+
+
+def mercator_xy(lats, lngs):
+    """
+    Web-mercator world coordinates in [0, 1] (tile space at zoom 0).
+    """
+    x = np.asarray(lngs, dtype=float) / 360 + 0.5
+    sin = np.sin(np.radians(np.asarray(lats, dtype=float)))
+    y = 0.5 - 0.25 * np.log((1 + sin) / (1 - sin)) / np.pi
+    return x, y
+
+
+def points_digest(lats, lngs):
+    """
+    Digest of a point set's coordinates, for cache keys that leave the arrays out.
+    """
+    digest = hashlib.sha1(np.asarray(lats, dtype=float).tobytes())
+    digest.update(np.asarray(lngs, dtype=float).tobytes())
+    return digest.hexdigest()
+
+
+def build_cluster_index(lats, lngs, min_zoom=8, max_zoom=17, radius=40, extent=256):
+    """
+    Supercluster-style grid index: at every zoom level, points are binned into
+    cells radius pixels wide and each occupied cell becomes one cluster at the
+    centroid of its members. Level max_zoom + 1 holds every point on its own.
+    Returns: Dict {zoom: DataFrame [lat, lng, n_points, point]}, where point is
+    the row position of the member for single-point clusters and -1 otherwise.
+    """
+    lats = np.asarray(lats, dtype=float)
+    lngs = np.asarray(lngs, dtype=float)
+    x, y = mercator_xy(lats, lngs)
+    positions = np.arange(len(lats))
+
+    index = {}
+    for zoom in range(min_zoom, max_zoom + 1):
+        cell = radius / (extent * 2 ** zoom)
+        keys = (np.floor(x / cell).astype(np.int64) << 32) + np.floor(y / cell).astype(np.int64)
+        _, inverse = np.unique(keys, return_inverse=True)
+        n_points = np.bincount(inverse)
+
+        member = np.empty(len(n_points), dtype=np.int64)
+        member[inverse] = positions
+        index[zoom] = pd.DataFrame({
+            "lat": np.bincount(inverse, weights=lats) / n_points,
+            "lng": np.bincount(inverse, weights=lngs) / n_points,
+            "n_points": n_points,
+            "point": np.where(n_points == 1, member, -1),
+        })
+
+    index[max_zoom + 1] = pd.DataFrame({
+        "lat": lats, "lng": lngs, "n_points": np.ones(len(lats), dtype=np.int64), "point": positions,
+    })
+    return index
+
+
+def clusters_at(index, zoom):
+    """
+    Clusters for a (possibly fractional) map zoom, clamped to the indexed levels.
+    """
+    levels = sorted(index)
+    zoom = min(max(int(round(zoom)), levels[0]), levels[-1])
+    return index[zoom]
+
+
+def cluster_marker(lat, lng, n_points, color):
+    size = int(26 + 8 * np.log10(n_points))
+    return folium.Marker(
+        location=[lat, lng],
+        icon=folium.DivIcon(
+            html=f"""
+            <div style="
+                background-color:{color};
+                opacity:0.85;
+                color:white;
+                font-family:'Sarabun', sans-serif;
+                font-weight:700;
+                font-size:12px;
+                width:{size}px;
+                height:{size}px;
+                line-height:{size}px;
+                text-align:center;
+                border-radius:50%;
+                border:2px solid white;
+                box-shadow: 0 0 3px rgba(0,0,0,0.5);
+            ">{n_points}</div>
+            """,
+            icon_size=(size, size),
+            icon_anchor=(size // 2, size // 2),
+        ),
+        tooltip=f"{n_points} รายการ",
+    )
+
+
+# map zoom -> heat grid bins per side; the finest level at or below the zoom is used
+HEAT_RESOLUTIONS = {0: 64, 12: 128, 14: 256}
+
+
+def heat_counts(lats, lngs, bins, weights=None, bounds=BANGKOK_BOUNDS):
+    """
+    np.histogram2d of the points on a bins x bins lat/lng grid over bounds.
+    Returns: (counts, lat_edges, lng_edges)
+    """
+    south, west = bounds["_southWest"]["lat"], bounds["_southWest"]["lng"]
+    north, east = bounds["_northEast"]["lat"], bounds["_northEast"]["lng"]
+    lats = np.asarray(lats, dtype=float)
+    lngs = np.asarray(lngs, dtype=float)
+    valid = ~(np.isnan(lats) | np.isnan(lngs))
+
+    return np.histogram2d(
+        lats[valid], lngs[valid],
+        bins=bins,
+        range=[[south, north], [west, east]],
+        weights=None if weights is None else np.asarray(weights, dtype=float)[valid],
+    )
+
+
+def heat_cells(counts, lat_edges, lng_edges):
+    """
+    Non-empty cells of a heat_counts grid. Cell weights are log-scaled to
+    [0, 1] so sparse cells stay visible next to dense ones, as with raw
+    leaflet.heat points.
+    Returns: DataFrame [lat, lng, weight] of the cell centers
+    """
+    i, j = np.nonzero(counts > 0)
+    values = np.log1p(counts[i, j])
+    return pd.DataFrame({
+        "lat": (lat_edges[i] + lat_edges[i + 1]) / 2,
+        "lng": (lng_edges[j] + lng_edges[j + 1]) / 2,
+        "weight": values / values.max() if len(values) else values,
+    })
+
+
+def heat_grid(lats, lngs, bins, weights=None, bounds=BANGKOK_BOUNDS):
+    """
+    Bin points into a bins x bins lat/lng grid over bounds.
+    Returns: DataFrame [lat, lng, weight] of the non-empty cell centers
+    """
+    return heat_cells(*heat_counts(lats, lngs, bins, weights, bounds))
+
+
+def build_heat_grids(lats, lngs, weights=None, resolutions=HEAT_RESOLUTIONS):
+    """
+    heat_grid at every resolution in resolutions.
+    Returns: Dict {min_zoom: DataFrame [lat, lng, weight]}
+    """
+    return {zoom: heat_grid(lats, lngs, bins, weights) for zoom, bins in resolutions.items()}
+
+
+def heat_cell_ids(lats, lngs, bins, bounds=BANGKOK_BOUNDS):
+    """
+    Flat cell (row * bins + column) of each point on the heat_counts grid,
+    -1 for points outside bounds or without coordinates.
+    """
+    south, west = bounds["_southWest"]["lat"], bounds["_southWest"]["lng"]
+    north, east = bounds["_northEast"]["lat"], bounds["_northEast"]["lng"]
+    lats = np.asarray(lats, dtype=float)
+    lngs = np.asarray(lngs, dtype=float)
+    with np.errstate(invalid="ignore"):
+        i = np.floor((lats - south) / (north - south) * bins)
+        j = np.floor((lngs - west) / (east - west) * bins)
+        # histogram2d counts points on the upper edge in the last bin
+        i[lats == north] = bins - 1
+        j[lngs == east] = bins - 1
+        valid = (i >= 0) & (i < bins) & (j >= 0) & (j < bins)
+    return np.where(valid, i * bins + j, -1).astype(np.int64)
+
+
+class GroupedHeatGrids:
+    """
+    Running heat_counts at every resolution, kept per group of points (e.g.
+    per (district, type_filtered, state)) as sparse cell counts, so the grids
+    of any set of groups are summed without binning the points again.
+    add(frame, sign=-1) removes points counted earlier.
+    """
+
+    def __init__(self, columns, resolutions=HEAT_RESOLUTIONS, bounds=BANGKOK_BOUNDS):
+        self.columns = list(columns)
+        self.resolutions = dict(resolutions)
+        self.bounds = bounds
+        self.counts = {zoom: None for zoom in self.resolutions}
+        # chunks are concatenated on the next result() instead of merged one by one
+        self.pending = {zoom: [] for zoom in self.resolutions}
+
+    def add(self, frame, sign=1):
+        if frame.empty:
+            return
+        keys = [frame[name].astype(object).to_numpy() for name in self.columns]
+        for zoom, bins in self.resolutions.items():
+            cells = heat_cell_ids(frame["lat"], frame["lng"], bins, self.bounds)
+            valid = cells >= 0
+            chunk = pd.Series(np.full(int(valid.sum()), sign, dtype=np.int64)).groupby(
+                [k[valid] for k in keys] + [cells[valid]], dropna=False
+            ).sum()
+            chunk.index = chunk.index.set_names(self.columns + ["cell"])
+            self.pending[zoom].append(chunk)
+
+    def cell_counts(self, zoom):
+        """
+        Returns: int Series indexed by (*columns, cell), zero counts dropped
+        """
+        pending = self.pending[zoom]
+        if pending:
+            parts = [self.counts[zoom]] + pending if self.counts[zoom] is not None else pending
+            counts = pd.concat(parts).groupby(level=list(range(len(self.columns) + 1)), dropna=False).sum()
+            self.counts[zoom] = counts[counts != 0]
+            self.pending[zoom] = []
+        return self.counts[zoom]
+
+    def result(self, match):
+        """
+        match(index): boolean mask of the cell_counts entries to include.
+        Returns: Dict {min_zoom: DataFrame [lat, lng, weight]}, like build_heat_grids
+        """
+        grids = {}
+        for zoom, bins in self.resolutions.items():
+            _, lat_edges, lng_edges = heat_counts([], [], bins, bounds=self.bounds)
+            counts = self.cell_counts(zoom)
+            dense = np.zeros(bins * bins)
+            if counts is not None and len(counts):
+                keep = match(counts.index)
+                cells = counts.index.get_level_values("cell").to_numpy()[keep]
+                dense = np.bincount(cells, weights=counts.to_numpy()[keep], minlength=bins * bins)
+            grids[zoom] = heat_cells(dense.reshape(bins, bins), lat_edges, lng_edges)
+        return grids
+
+
+def heat_at(grids, zoom):
+    """
+    Grid for a map zoom: the finest level whose min_zoom is at or below it.
+    """
+    levels = sorted(grids)
+    return grids[max([z for z in levels if z <= zoom] or levels[:1])]
+
+
+DISTRICT_GEOJSON_URL = "https://services1.arcgis.com/jSaRWj2TDlcN1zOC/arcgis/rest/services/TH_Bangkok_District/FeatureServer/0/query"
+# simplified boundaries to commit with the repo (not yet present); written by bundle_district_geojson()
+DISTRICT_GEOJSON_BUNDLED = "data/bangkok_districts.geojson"
+DISTRICT_GEOJSON_PATH = ".cache/bangkok_districts.geojson"
+DISTRICT_GEOJSON_MAX_AGE = 7 * 24 * 3600
+DISTRICT_GEOJSON_TIMEOUT = 5
+# seconds to wait after a failed download before trying the service again
+DISTRICT_GEOJSON_RETRY = 600
+# simplification tolerance in degrees (~0.0001 deg = 11 m)
+DISTRICT_TOLERANCES = {"full": 0, "fine": 0.0001}
+
+# tolerance -> simplified FeatureCollection, filled on first use per process
+_district_memo = {}
+_district_fetch = {"failed_at": None}
+
+
+def simplify_ring(coords, tolerance):
+    """
+    Douglas-Peucker simplification of one closed [lng, lat] ring.
+    Rings that would collapse below 4 points are returned unchanged.
+    """
+    pts = np.asarray(coords, dtype=float)
+    if tolerance <= 0 or len(pts) <= 4:
+        return coords
+
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(pts) - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b <= a + 1:
+            continue
+        seg = pts[b] - pts[a]
+        rel = pts[a + 1:b] - pts[a]
+        norm = np.hypot(seg[0], seg[1])
+        if norm == 0:
+            # closed ring: first and last points coincide
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            dist = np.abs(seg[0] * rel[:, 1] - seg[1] * rel[:, 0]) / norm
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            k = a + 1 + i
+            keep[k] = True
+            stack.append((a, k))
+            stack.append((k, b))
+
+    if keep.sum() < 4:
+        return coords
+    return pts[keep].tolist()
+
+
+def simplify_geometry(geometry, tolerance):
+    if geometry is None or tolerance <= 0:
+        return geometry
+    if geometry["type"] == "Polygon":
+        coords = [simplify_ring(ring, tolerance) for ring in geometry["coordinates"]]
+    elif geometry["type"] == "MultiPolygon":
+        coords = [[simplify_ring(ring, tolerance) for ring in poly] for poly in geometry["coordinates"]]
+    else:
+        return geometry
+    return {**geometry, "coordinates": coords}
+
+
+def fetch_district_geojson():
+    """
+    Download the district boundaries from ArcGIS and write them to DISTRICT_GEOJSON_PATH.
+    """
+    res = requests.get(
+        DISTRICT_GEOJSON_URL,
+        params={"where": "1=1", "outFields": "*", "f": "geojson"},
+        timeout=DISTRICT_GEOJSON_TIMEOUT,
+    )
+    res.raise_for_status()
+    data = res.json()
+
+    os.makedirs(os.path.dirname(DISTRICT_GEOJSON_PATH) or ".", exist_ok=True)
+    tmp_path = DISTRICT_GEOJSON_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, DISTRICT_GEOJSON_PATH)
+    return data
+
+
+def bundle_district_geojson(level="fine", path=DISTRICT_GEOJSON_BUNDLED):
+    """
+    Download the district boundaries, simplify them to DISTRICT_TOLERANCES[level]
+    and write them to path, the copy load_district_geojson() reads first.
+    """
+    tolerance = DISTRICT_TOLERANCES[level]
+    raw = fetch_district_geojson()
+    data = {
+        "type": "FeatureCollection",
+        "features": [
+            {**f, "geometry": simplify_geometry(f.get("geometry"), tolerance)}
+            for f in raw.get("features", [])
+        ],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    return data
+
+
+def load_district_geojson():
+    """
+    District boundaries: the bundled DISTRICT_GEOJSON_BUNDLED when present,
+    else the cached download. The remote service is only queried when the
+    cache is missing or older than DISTRICT_GEOJSON_MAX_AGE, at most once per
+    DISTRICT_GEOJSON_RETRY after a failure, and a stale file is still used when
+    the download fails (e.g. no outbound network).
+    """
+    if os.path.exists(DISTRICT_GEOJSON_BUNDLED):
+        with open(DISTRICT_GEOJSON_BUNDLED, encoding="utf-8") as f:
+            return json.load(f)
+
+    try:
+        age = time.time() - os.path.getmtime(DISTRICT_GEOJSON_PATH)
+    except OSError:
+        age = None
+
+    failed_at = _district_fetch["failed_at"]
+    may_fetch = failed_at is None or time.monotonic() - failed_at > DISTRICT_GEOJSON_RETRY
+    if (age is None or age > DISTRICT_GEOJSON_MAX_AGE) and may_fetch:
+        try:
+            data = fetch_district_geojson()
+            _district_fetch["failed_at"] = None
+            return data
+        except Exception:
+            _district_fetch["failed_at"] = time.monotonic()
+    if age is None:
+        return {"type": "FeatureCollection", "features": []}
+
+    with open(DISTRICT_GEOJSON_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def district_geojson(level="fine"):
+    """
+    District FeatureCollection simplified to DISTRICT_TOLERANCES[level].
+    Each call gets its own properties dicts, so callers can set per-rerun
+    values (e.g. fillColor) without touching the memoized geometry.
+    """
+    tolerance = DISTRICT_TOLERANCES[level]
+    data = _district_memo.get(tolerance)
+    if data is None:
+        raw = load_district_geojson()
+        data = {
+            "type": "FeatureCollection",
+            "features": [
+                {**f, "geometry": simplify_geometry(f.get("geometry"), tolerance)}
+                for f in raw.get("features", [])
+            ],
+        }
+        # an empty fallback is not memoized so the next call retries the download
+        if data["features"]:
+            _district_memo[tolerance] = data
+
+    return {
+        "type": "FeatureCollection",
+        "features": [{**f, "properties": dict(f.get("properties") or {})} for f in data["features"]],
+    }
+
+
+CHOROPLETH_STEPS = 50
+CHOROPLETH_GRADIENTS = {
+    "time": [(111, 156, 61), (165, 201, 15), (255, 179, 102), (255, 136, 41), (254, 107, 64)],
+    "complete": [(254, 107, 64), (255, 136, 41), (255, 179, 102), (165, 201, 15), (111, 156, 61)],
+}
+NO_DATA_COLOR = "rgba(230,230,230,0.3)"
+
+
+def gradient_table(gradient, total_steps=CHOROPLETH_STEPS):
+    """
+    rgba() string for each of total_steps steps along gradient.
+    """
+    seg = len(gradient) - 1
+    seg_length = total_steps / seg
+    table = []
+    for step in range(total_steps):
+        seg_index = int(step // seg_length)
+        seg_pos = (step % seg_length) / seg_length
+        r1, g1, b1 = gradient[seg_index]
+        r2, g2, b2 = gradient[min(seg_index + 1, seg)]
+        r = int(r1 + (r2 - r1) * seg_pos)
+        g = int(g1 + (g2 - g1) * seg_pos)
+        b = int(b1 + (b2 - b1) * seg_pos)
+        table.append(f"rgba({r},{g},{b},0.7)")
+    return np.array(table, dtype=object)
+
+
+COLOR_TABLES = {name: gradient_table(g) for name, g in CHOROPLETH_GRADIENTS.items()}
+
+
+def value_colors(values, min_val, max_val, gradient="time"):
+    """
+    Map values onto the gradient's step table in one pass; NaN gets NO_DATA_COLOR.
+    """
+    table = COLOR_TABLES.get(gradient, COLOR_TABLES["time"])
+    values = np.asarray(values, dtype=float)
+    missing = np.isnan(values)
+    if max_val == min_val:
+        norm = np.zeros(len(values))
+    else:
+        norm = (values - min_val) / (max_val - min_val)
+
+    steps = np.clip(np.where(missing, 0, norm) * (len(table) - 1), 0, len(table) - 1).astype(int)
+    return np.where(missing, NO_DATA_COLOR, table[steps])
+
+
+def choropleth_geojson(geojson, values, min_val, max_val, gradient="time", key="AMP_NAMT"):
+    """
+    Set "value" and "fillColor" on every feature from values ({district: value}).
+    Writes into the features' properties, so pass a per-call copy such as
+    district_geojson() returns.
+    """
+    features = geojson["features"]
+    matched = [values.get(f["properties"].get(key)) for f in features]
+    colors = value_colors([np.nan if v is None else v for v in matched], min_val, max_val, gradient)
+
+    for feature, value, color in zip(features, matched, colors):
+        feature["properties"]["value"] = value
+        feature["properties"]["fillColor"] = color
+    return geojson
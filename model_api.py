@@ -1,38 +1,140 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 import streamlit as st
 import pandas as pd
 
-API_URL = PG_SSL  = st.secrets.get("API_URL")  
+API_URL = PG_SSL  = st.secrets.get("API_URL")
+PREDICT_WORKERS = int(st.secrets.get("PREDICT_WORKERS", 8))
+PREDICT_TIMEOUT = 30
+PREDICT_CHUNK_SIZE = int(st.secrets.get("PREDICT_CHUNK_SIZE", 500))
+PREDICT_RETRIES = 3
+PREDICT_BACKOFF = 0.5
+# seconds before /predict_batch is tried again after the server answered 404
+PREDICT_BULK_REPROBE = 600
+MODEL_VERSION = st.secrets.get("MODEL_VERSION", "v1")
+PREDICTION_STORE_PATH = st.secrets.get("PREDICTION_STORE_PATH", ".cache/predictions.sqlite3")
+PREDICTION_STORE_MAX = int(st.secrets.get("PREDICTION_STORE_MAX", 200000))
+# in-memory results also hold the payload (comment text) in their keys, so fewer are kept
+PREDICTION_CACHE_MAX = min(int(st.secrets.get("PREDICTION_CACHE_MAX", 50000)), PREDICTION_STORE_MAX)
 
-def predict_batch(df):
-    results = []
-
-    for _, r in df.iterrows():
-        payload = {
-            "comment": r["comment"],
-            "type": r["type"],
-            "organization": r["organization"],
-            "district": r["district"],
-            "subdistrict": r["subdistrict"],
-            "timestamp": r["timestamp"].isoformat() if isinstance(r["timestamp"], pd.Timestamp) else str(r["timestamp"])
-        }
+PAYLOAD_FIELDS = ["comment", "type", "organization", "district", "subdistrict", "timestamp"]
 
-        try:
-            res = requests.post(f"{API_URL}/predict", json=payload, timeout=30)
-            res.raise_for_status()
-            results.append(res.json())
 
-        except Exception as e:
-            st.error(f"Prediction API error for ticket {r['ticket_id']}: {e}")
-            results.append(None)
+@st.cache_resource
+def get_session():
+    """
+    Shared keep-alive session for the prediction API.
+    The connection pool is sized to the worker count so threads never wait on a socket.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=PREDICT_WORKERS,
+        pool_maxsize=PREDICT_WORKERS
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
-    return results
 
-def predict_time(comment, type_, organization, district, subdistrict, timestamp):
+@st.cache_resource
+def get_prediction_cache():
+    """
+    Process-wide LRU: (ticket_id, *payload values) -> prediction result,
+    bounded by PREDICTION_CACHE_MAX. Shared by every Streamlit session, so a
+    rerun never re-predicts a ticket; evicted ones come back from the store.
+    """
+    return {"lock": threading.Lock(), "results": OrderedDict(), "bulk_missing_at": None}
+
+
+@st.cache_resource
+def get_prediction_store():
+    """
+    On-disk store: hash(payload, MODEL_VERSION) -> prediction JSON.
+    Survives restarts; least recently used rows are evicted past PREDICTION_STORE_MAX.
+    """
+    os.makedirs(os.path.dirname(PREDICTION_STORE_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(PREDICTION_STORE_PATH, check_same_thread=False)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS predictions (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            accessed_at REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS predictions_accessed_at ON predictions (accessed_at)")
+    conn.commit()
+    return {"lock": threading.Lock(), "conn": conn}
+
+
+def store_key(payload):
+    raw = json.dumps([MODEL_VERSION] + [str(payload[f]) for f in PAYLOAD_FIELDS], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def load_stored(payloads):
+    """
+    Look up {cache_key: payload} in the on-disk store.
+    Returns: Dict {cache_key: prediction} for the hits only
+    """
+    store = get_prediction_store()
+    # tickets with identical payloads share one stored row
+    hashes = {}
+    for k, p in payloads.items():
+        hashes.setdefault(store_key(p), []).append(k)
+    found = {}
+    now = time.time()
+
+    with store["lock"]:
+        conn = store["conn"]
+        keys = list(hashes)
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            marks = ",".join("?" * len(batch))
+            rows = conn.execute(f"SELECT key, value FROM predictions WHERE key IN ({marks})", batch).fetchall()
+            for h, value in rows:
+                prediction = json.loads(value)
+                for k in hashes[h]:
+                    found[k] = prediction
+            conn.execute(f"UPDATE predictions SET accessed_at = ? WHERE key IN ({marks})", [now] + batch)
+        conn.commit()
+
+    return found
+
+
+def save_stored(predictions, payloads):
+    store = get_prediction_store()
+    now = time.time()
+    rows = [
+        (store_key(payloads[k]), json.dumps(v, ensure_ascii=False), now)
+        for k, v in predictions.items() if v is not None
+    ]
+    if not rows:
+        return
+
+    with store["lock"]:
+        conn = store["conn"]
+        conn.executemany("INSERT OR REPLACE INTO predictions (key, value, accessed_at) VALUES (?, ?, ?)", rows)
+        conn.execute("""
+            DELETE FROM predictions WHERE key IN (
+                SELECT key FROM predictions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (PREDICTION_STORE_MAX,))
+        conn.commit()
+
+
+def build_payload(comment, type_, organization, district, subdistrict, timestamp):
     if isinstance(timestamp, pd.Timestamp):
         timestamp = timestamp.isoformat()
-        
-    payload = {
+
+    return {
         "comment": comment,
         "type": type_,
         "organization": organization,
@@ -41,11 +143,181 @@ def predict_time(comment, type_, organization, district, subdistrict, timestamp)
         "timestamp": timestamp
     }
 
+
+def row_payload(r):
+    return build_payload(
+        r["comment"], r.get("type", ""), r["organization"],
+        r["district"], r["subdistrict"], r.get("timestamp")
+    )
+
+
+def cache_key(ticket_id, payload):
+    return (ticket_id,) + tuple(str(payload[f]) for f in PAYLOAD_FIELDS)
+
+
+def post_predict(payload):
+    res = get_session().post(f"{API_URL}/predict", json=payload, timeout=PREDICT_TIMEOUT)
+    res.raise_for_status()
+    return res.json()
+
+
+def predict_tickets(df):
+    """
+    Predict every row of df in bulk, reusing in-memory and on-disk results.
+    Returns: Dict {ticket_id: prediction or None}
+    """
+    cache = get_prediction_cache()
+    results = {}
+    pending = {}
+
+    with cache["lock"]:
+        for _, r in df.iterrows():
+            payload = row_payload(r)
+            key = cache_key(r["ticket_id"], payload)
+            if key in cache["results"]:
+                cache["results"].move_to_end(key)
+                results[r["ticket_id"]] = cache["results"][key]
+            else:
+                pending[key] = payload
+
+    if not pending:
+        return results
+
+    fetched = load_stored(pending)
+    missing = {k: p for k, p in pending.items() if k not in fetched}
+    if missing:
+        predicted = predict_pending(missing)
+        save_stored(predicted, missing)
+        fetched.update(predicted)
+
+    with cache["lock"]:
+        for key, prediction in fetched.items():
+            results[key[0]] = prediction
+            # failed tickets stay uncached so the next rerun retries them
+            if prediction is not None:
+                cache["results"][key] = prediction
+        while len(cache["results"]) > PREDICTION_CACHE_MAX:
+            cache["results"].popitem(last=False)
+
+    return results
+
+
+class BulkRouteMissing(Exception):
+    """
+    The server has no /predict_batch route. completed holds the results of
+    the chunks answered before that was found out.
+    """
+
+    def __init__(self, completed=None):
+        super().__init__("no /predict_batch route")
+        self.completed = completed or {}
+
+
+def predict_pending(pending):
+    """
+    Predict {cache_key: payload} through /predict_batch, falling back to
+    concurrent per-row /predict calls when the server has no bulk route.
+    A missing route is re-probed after PREDICT_BULK_REPROBE seconds, so a
+    later deploy of /predict_batch is picked up without a restart.
+    Returns: Dict {cache_key: prediction or None}
+    """
+    cache = get_prediction_cache()
+    completed = {}
+    missing_at = cache["bulk_missing_at"]
+    if missing_at is None or time.monotonic() - missing_at > PREDICT_BULK_REPROBE:
+        try:
+            results = predict_chunks(pending)
+            cache["bulk_missing_at"] = None
+            return results
+        except BulkRouteMissing as e:
+            cache["bulk_missing_at"] = time.monotonic()
+            # only the rows the bulk route did not answer go through /predict
+            completed = e.completed
+            pending = {k: p for k, p in pending.items() if k not in completed}
+
+    def fetch(item):
+        key, payload = item
+        try:
+            return key, post_predict(payload)
+        except Exception:
+            return key, None
+
+    with ThreadPoolExecutor(max_workers=PREDICT_WORKERS) as pool:
+        return {**completed, **dict(pool.map(fetch, pending.items()))}
+
+
+def to_columns(ticket_ids, payloads):
+    columns = {"ticket_id": list(ticket_ids)}
+    for f in PAYLOAD_FIELDS:
+        columns[f] = [None if pd.isna(p[f]) else p[f] for p in payloads]
+    return columns
+
+
+def post_predict_chunk(keys, payloads):
+    """
+    POST one chunk as columnar JSON and map the columnar response back by ticket_id.
+    Tickets missing from the response come back as None.
+    """
+    res = get_session().post(
+        f"{API_URL}/predict_batch",
+        json=to_columns([k[0] for k in keys], payloads),
+        timeout=PREDICT_TIMEOUT
+    )
+    if res.status_code in (404, 405):
+        raise BulkRouteMissing()
+    res.raise_for_status()
+
+    body = res.json()
+    fields = [c for c in body if c != "ticket_id"]
+    by_ticket = {
+        tid: {c: body[c][i] for c in fields}
+        for i, tid in enumerate(body.get("ticket_id", []))
+    }
+    return {k: by_ticket.get(k[0]) for k in keys}
+
+
+def predict_chunks(pending):
+    items = list(pending.items())
+    chunks = [items[i:i + PREDICT_CHUNK_SIZE] for i in range(0, len(items), PREDICT_CHUNK_SIZE)]
+    results = {key: None for key, _ in items}
+    answered = set()
+
+    for attempt in range(PREDICT_RETRIES):
+        failed = []
+        for chunk in chunks:
+            keys = [k for k, _ in chunk]
+            try:
+                results.update(post_predict_chunk(keys, [p for _, p in chunk]))
+                answered.update(keys)
+            except BulkRouteMissing:
+                raise BulkRouteMissing({k: results[k] for k in answered})
+            except Exception:
+                failed.append(chunk)
+
+        if not failed or attempt == PREDICT_RETRIES - 1:
+            break
+        chunks = failed
+        time.sleep(PREDICT_BACKOFF * 2 ** attempt)
+
+    return results
+
+
+def predict_batch(df):
+    predictions = predict_tickets(df)
+    results = [predictions.get(tid) for tid in df["ticket_id"]]
+
+    failed = sum(r is None for r in results)
+    if failed:
+        st.error(f"Prediction API error for {failed} of {len(results)} tickets")
+
+    return results
+
+def predict_time(comment, type_, organization, district, subdistrict, timestamp):
+    payload = build_payload(comment, type_, organization, district, subdistrict, timestamp)
+
     try:
-        res = requests.post(f"{API_URL}/predict", json=payload, timeout=30)
-        res.raise_for_status()
-        return res.json()
+        return post_predict(payload)
 
     except Exception as e:
-        
+
         return None
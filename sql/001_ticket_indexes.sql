@@ -0,0 +1,15 @@
+-- Indexes matching the half-open timestamp ranges built by db_utils.date_range_clause.
+-- Safe to re-run; apply with db_utils.create_ticket_indexes() or psql -f.
+
+CREATE INDEX IF NOT EXISTS traffy_tickets_timestamp_idx
+    ON traffy_tickets (timestamp);
+
+CREATE INDEX IF NOT EXISTS traffy_tickets_district_timestamp_idx
+    ON traffy_tickets (district, timestamp);
+
+CREATE INDEX IF NOT EXISTS traffy_tickets_ticket_id_idx
+    ON traffy_tickets (ticket_id);
+
+-- MAX(data_version) backs every version-keyed cache
+CREATE INDEX IF NOT EXISTS traffy_tickets_data_version_idx
+    ON traffy_tickets (data_version);
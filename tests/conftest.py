@@ -0,0 +1,17 @@
+"""
+The app modules read st.secrets when imported. Point Streamlit at a throwaway
+secrets.toml (under a temporary HOME) before any of them is imported.
+"""
+import os
+import sys
+import tempfile
+
+_home = tempfile.mkdtemp(prefix="dsde-tests-")
+os.makedirs(os.path.join(_home, ".streamlit"))
+with open(os.path.join(_home, ".streamlit", "secrets.toml"), "w") as f:
+    f.write('MAPBOX_API_KEY = "test"\n')
+    f.write('API_URL = "http://127.0.0.1:9"\n')
+    f.write(f'PREDICTION_STORE_PATH = "{os.path.join(_home, "predictions.sqlite3")}"\n')
+os.environ["HOME"] = _home
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,118 @@
+"""
+ConnectionPool bookkeeping and COPY parsing against fake psycopg2 connections.
+"""
+from contextlib import contextmanager
+
+import numpy as np
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+import db_utils
+
+
+class FakeConn:
+    def __init__(self):
+        self.closed = 0
+        self.info = type("Info", (), {"transaction_status": psycopg2.extensions.TRANSACTION_STATUS_IDLE})()
+
+    def close(self):
+        self.closed = 1
+
+    def rollback(self):
+        pass
+
+    def cursor(self):
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, sql):
+                pass
+
+        return Cursor()
+
+
+@pytest.fixture
+def connects(monkeypatch):
+    opened = []
+
+    def connect(**kwargs):
+        opened.append(FakeConn())
+        return opened[-1]
+
+    monkeypatch.setattr(psycopg2, "connect", connect)
+    return opened
+
+
+def test_returned_connections_stay_open_for_reuse(connects):
+    pool = db_utils.ConnectionPool(1, 3, max_idle=60)
+    for _ in range(2):
+        conns = [pool.getconn(timeout=1) for _ in range(3)]
+        for conn in conns:
+            pool.putconn(conn)
+
+    # a burst above minconn opens its connections once, not on every checkout
+    assert len(connects) == 3
+    assert not any(c.closed for c in connects)
+    assert len(pool._idle) == 3
+
+
+def test_stale_idle_connections_are_replaced(connects):
+    pool = db_utils.ConnectionPool(2, 3, max_idle=60)
+    a, b = pool.getconn(timeout=1), pool.getconn(timeout=1)
+    pool.putconn(a)
+    pool.putconn(b)
+
+    # both idle connections are past max_idle; neither may be handed out
+    pool._idle = [(conn, returned_at - 120) for conn, returned_at in pool._idle]
+    conn = pool.getconn(timeout=1)
+
+    assert conn not in (a, b)
+    assert a.closed and b.closed
+    assert pool.stats["recycled"] == 2
+
+
+def test_expired_connections_are_closed_on_return(connects):
+    pool = db_utils.ConnectionPool(0, 3, max_idle=60)
+    a, b = pool.getconn(timeout=1), pool.getconn(timeout=1)
+    pool.putconn(a)
+    pool._idle = [(conn, returned_at - 120) for conn, returned_at in pool._idle]
+    pool.putconn(b)
+
+    assert a.closed and not b.closed
+    assert [conn for conn, _ in pool._idle] == [b]
+
+
+def test_copy_frame_keeps_empty_strings_apart_from_null(monkeypatch):
+    statements = []
+
+    class CopyCursor:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def mogrify(self, query, params):
+            return query.encode("utf-8")
+
+        def copy_expert(self, sql, buf):
+            statements.append(sql)
+            # what PostgreSQL writes for NULL, '' and text with NULL '\N'
+            buf.write('ticket_id,comment,lat\nT-1,\\N,13.7\nT-2,"",\\N\nT-3,ถนน,13.8\n'.encode("utf-8"))
+
+    @contextmanager
+    def get_conn():
+        yield type("Conn", (), {"cursor": lambda self: CopyCursor()})()
+
+    monkeypatch.setattr(db_utils, "get_conn", get_conn)
+    df = db_utils.copy_frame("SELECT ticket_id, comment, lat FROM traffy_tickets;")
+
+    assert "NULL '\\N'" in statements[0]
+    assert df["comment"].isna().tolist() == [True, False, False]
+    assert df["comment"].iloc[1] == ""
+    assert np.isnan(df["lat"].iloc[1]) and df["lat"].iloc[0] == 13.7
@@ -0,0 +1,67 @@
+"""
+map_utils district boundaries and choropleth colouring.
+"""
+import json
+
+import pytest
+
+import map_utils
+
+
+def square(lng, lat):
+    return {
+        "type": "Polygon",
+        "coordinates": [[[lng, lat], [lng + 1, lat], [lng + 1, lat + 1], [lng, lat + 1], [lng, lat]]],
+    }
+
+
+def collection(*names):
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {"type": "Feature", "properties": {"AMP_NAMT": name}, "geometry": square(i, 0)}
+            for i, name in enumerate(names)
+        ],
+    }
+
+
+@pytest.fixture
+def offline(tmp_path, monkeypatch):
+    """No bundled file, no cached download, and every download fails."""
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        raise OSError("network unreachable")
+
+    monkeypatch.setattr(map_utils, "DISTRICT_GEOJSON_BUNDLED", str(tmp_path / "bundled.geojson"))
+    monkeypatch.setattr(map_utils, "DISTRICT_GEOJSON_PATH", str(tmp_path / "cache.geojson"))
+    monkeypatch.setattr(map_utils, "fetch_district_geojson", fetch)
+    monkeypatch.setattr(map_utils, "_district_memo", {})
+    monkeypatch.setattr(map_utils, "_district_fetch", {"failed_at": None})
+    return calls
+
+
+def test_bundled_geojson_is_read_without_the_network(offline):
+    with open(map_utils.DISTRICT_GEOJSON_BUNDLED, "w", encoding="utf-8") as f:
+        json.dump(collection("A", "B"), f)
+
+    features = map_utils.district_geojson()["features"]
+    assert [f["properties"]["AMP_NAMT"] for f in features] == ["A", "B"]
+    assert offline == []
+
+
+def test_failed_download_is_not_retried_on_every_call(offline):
+    assert map_utils.district_geojson()["features"] == []
+    assert map_utils.district_geojson()["features"] == []
+    assert len(offline) == 1
+
+
+@pytest.mark.parametrize("min_val, max_val", [(50, 50), (0, 100)])
+def test_districts_without_a_value_get_no_data_color(min_val, max_val):
+    gj = collection("A", "B", "C")
+    map_utils.choropleth_geojson(gj, {"A": 50.0}, min_val, max_val)
+
+    colors = [f["properties"]["fillColor"] for f in gj["features"]]
+    assert colors[0] != map_utils.NO_DATA_COLOR
+    assert colors[1:] == [map_utils.NO_DATA_COLOR] * 2
@@ -0,0 +1,175 @@
+"""
+model_api bulk prediction against a local stub of the prediction API.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+import model_api
+
+
+class StubAPI:
+    """
+    /predict_batch answers columnar chunks until batch_limit chunks were
+    served, then 404s (no bulk route); fail_first makes the first batch
+    call a 500. /predict answers one payload. Every call is recorded.
+    """
+
+    def __init__(self, batch_limit=None, fail_first=False):
+        self.batch_limit = batch_limit
+        self.fail_first = fail_first
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def handle(self, path, body):
+        with self.lock:
+            self.calls.append((path, body))
+            n_batch = sum(p == "/predict_batch" for p, _ in self.calls)
+
+        if path == "/predict_batch":
+            if self.batch_limit is not None and n_batch > self.batch_limit:
+                return 404, {}
+            if self.fail_first and n_batch == 1:
+                return 500, {}
+            return 200, {
+                "ticket_id": body["ticket_id"],
+                "predicted_hours": [hours(c) for c in body["comment"]],
+            }
+        if path == "/predict":
+            return 200, {"predicted_hours": hours(body["comment"])}
+        return 404, {}
+
+    def posted(self, path):
+        return [body for p, body in self.calls if p == path]
+
+
+def hours(comment):
+    return float(comment.removeprefix("c"))
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    api = StubAPI()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            status, payload = api.handle(self.path, body)
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    monkeypatch.setattr(model_api, "API_URL", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(model_api, "PREDICT_CHUNK_SIZE", 2)
+    monkeypatch.setattr(model_api, "PREDICT_BACKOFF", 0)
+    model_api.get_prediction_cache.clear()
+    yield api
+    server.shutdown()
+    server.server_close()
+
+
+def pending_payloads(n):
+    pending = {}
+    for i in range(n):
+        payload = model_api.build_payload(f"c{i}", "ถนน", "org", "บางรัก", "สีลม", "2024-01-01T00:00:00")
+        pending[model_api.cache_key(f"T-{i}", payload)] = payload
+    return pending
+
+
+def assert_predicted(results, pending):
+    assert set(results) == set(pending)
+    for key, payload in pending.items():
+        assert results[key] == {"predicted_hours": hours(payload["comment"])}
+
+
+def test_chunks_are_posted_columnar_and_mapped_back(stub):
+    pending = pending_payloads(5)
+    results = model_api.predict_pending(pending)
+
+    assert_predicted(results, pending)
+    assert [len(body["ticket_id"]) for body in stub.posted("/predict_batch")] == [2, 2, 1]
+    assert stub.posted("/predict") == []
+
+
+def test_failed_chunk_is_retried(stub):
+    stub.fail_first = True
+    pending = pending_payloads(3)
+    results = model_api.predict_pending(pending)
+
+    assert_predicted(results, pending)
+    # chunk 1 fails, chunk 2 succeeds, then only chunk 1 is sent again
+    assert [body["ticket_id"] for body in stub.posted("/predict_batch")] == [
+        ["T-0", "T-1"], ["T-2"], ["T-0", "T-1"]
+    ]
+
+
+def test_missing_bulk_route_falls_back_to_per_row_requests(stub):
+    stub.batch_limit = 0
+    pending = pending_payloads(3)
+    results = model_api.predict_pending(pending)
+
+    assert_predicted(results, pending)
+    assert len(stub.posted("/predict")) == 3
+    assert model_api.get_prediction_cache()["bulk_missing_at"] is not None
+
+
+def test_missing_bulk_route_is_probed_again_later(stub, monkeypatch):
+    stub.batch_limit = 0
+    model_api.predict_pending(pending_payloads(2))
+    model_api.predict_pending(pending_payloads(2))
+    # within PREDICT_BULK_REPROBE the bulk route is not tried again
+    assert len(stub.posted("/predict_batch")) == 1
+
+    stub.batch_limit = None
+    monkeypatch.setattr(model_api, "PREDICT_BULK_REPROBE", -1)
+    pending = pending_payloads(2)
+    assert_predicted(model_api.predict_pending(pending), pending)
+    assert len(stub.posted("/predict_batch")) == 2
+    assert model_api.get_prediction_cache()["bulk_missing_at"] is None
+
+
+def test_bulk_route_lost_midway_keeps_completed_chunks(stub):
+    stub.batch_limit = 1
+    pending = pending_payloads(5)
+    results = model_api.predict_pending(pending)
+
+    assert_predicted(results, pending)
+    # the first chunk (T-0, T-1) was answered in bulk; only the rest goes per row
+    assert sorted(body["comment"] for body in stub.posted("/predict")) == ["c2", "c3", "c4"]
+
+
+def test_stored_prediction_is_found_for_every_ticket_with_that_payload():
+    payload = model_api.build_payload("c7", "ถนน", "org", "บางรัก", "สีลม", "2024-01-01T00:00:00")
+    keys = [model_api.cache_key(f"T-{i}", payload) for i in range(3)]
+    model_api.save_stored({keys[0]: {"predicted_hours": 7.0}}, {keys[0]: payload})
+
+    found = model_api.load_stored({k: payload for k in keys})
+    assert found == {k: {"predicted_hours": 7.0} for k in keys}
+
+
+def test_in_memory_results_are_bounded(stub, monkeypatch):
+    monkeypatch.setattr(model_api, "PREDICTION_CACHE_MAX", 3)
+    df = pd.DataFrame({
+        "ticket_id": [f"M-{i}" for i in range(5)],
+        "comment": [f"c{i}" for i in range(5)],
+        "type": "ถนน", "organization": "org", "district": "บางรัก", "subdistrict": "สีลม",
+        "timestamp": "2024-01-01T00:00:00",
+    })
+    results = model_api.predict_tickets(df)
+
+    assert results == {f"M-{i}": {"predicted_hours": float(i)} for i in range(5)}
+    # the most recently predicted tickets are kept
+    assert [key[0] for key in model_api.get_prediction_cache()["results"]] == ["M-2", "M-3", "M-4"]
@@ -0,0 +1,65 @@
+"""
+TicketCube / GroupedHeatGrids slices against filtering the tickets directly.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from map_utils import GroupedHeatGrids, build_heat_grids
+from ticket_utils import TicketCube, classify_types, facet_mask, filter_tickets
+
+DISTRICTS = ["บางรัก", "ปทุมวัน", "สาทร", None]
+TYPES = ["ถนน", "ทางเท้า,แสงสว่าง", "น้ำท่วม", None]
+STATES = ["เสร็จสิ้น", "กำลังดำเนินการ", "รอรับเรื่อง", None]
+
+
+@pytest.fixture(scope="module")
+def tickets():
+    rng = np.random.default_rng(7)
+    n = 2000
+    df = pd.DataFrame({
+        "district": rng.choice(np.array(DISTRICTS, dtype=object), n),
+        "type": rng.choice(np.array(TYPES, dtype=object), n),
+        "state": rng.choice(np.array(STATES, dtype=object), n),
+        "lat": rng.uniform(13.5, 13.95, n),
+        "lng": rng.uniform(100.35, 100.9, n),
+        "duration_minutes_finished": rng.choice([0, np.nan, 30, 90.5], n),
+    })
+    return df.assign(type_filtered=classify_types(df["type"]))
+
+
+@pytest.fixture(scope="module")
+def aggregates(tickets):
+    cube, heat = TicketCube(), GroupedHeatGrids(TicketCube.KEY)
+    for start in range(0, len(tickets), 500):
+        cube.add(tickets.iloc[start:start + 500])
+        heat.add(tickets.iloc[start:start + 500])
+    # removing and re-adding rows leaves the totals unchanged
+    cube.add(tickets.iloc[:100], sign=-1)
+    heat.add(tickets.iloc[:100], sign=-1)
+    cube.add(tickets.iloc[:100])
+    heat.add(tickets.iloc[:100])
+    return cube, heat
+
+
+@pytest.mark.parametrize("selection", [
+    (["บางรัก"], ["ถนน"], ()),
+    (["บางรัก", "สาทร"], ["ถนน", "น้ำท่วม", "อื่น ๆ"], ["เสร็จสิ้น"]),
+    (DISTRICTS[:3], ["ถนน", "ทางเท้า", "น้ำท่วม", "อื่น ๆ"], ()),
+    ([], ["ถนน"], ()),
+])
+def test_slices_match_filtered_tickets(tickets, aggregates, selection):
+    cube, heat = aggregates
+    expected = filter_tickets(tickets, *selection)
+
+    summary = {d["district"]: d for d in cube.district_summary(*selection)}
+    assert {k: d["total"] for k, d in summary.items()} == expected.groupby("district").size().to_dict()
+    finished = (expected["state"] == "เสร็จสิ้น").groupby(expected["district"]).sum()
+    assert {k: d["finished"] for k, d in summary.items()} == finished.to_dict()
+
+    type_counts = expected.groupby(["district", "type_filtered"]).size()
+    assert cube.type_counts(*selection).to_dict() == type_counts.to_dict()
+
+    grids = heat.result(lambda index: facet_mask(index, *selection))
+    for zoom, grid in build_heat_grids(expected["lat"], expected["lng"]).items():
+        assert np.allclose(grids[zoom].to_numpy(), grid.to_numpy())
@@ -0,0 +1,401 @@
+import numpy as np
+import pandas as pd
+
+BASE_CATEGORIES = [
+    "ถนน", "แสงสว่าง", "ทางเท้า", "น้ำท่วม", "ร้องเรียน",
+    "จราจร", "กีดขวาง", "ความสะอาด", "ความปลอดภัย",
+    "ท่อระบายน้ำ", "เสียง", "ป้าย", "ต้นไม้", "สะพาน",
+    "คลอง", "สัตว์จรจัด", "สายไฟ", "PM2.5", "คนจรจัด",
+    "สอบถาม", "เสนอแนะ", "ห้องน้ำ", "การเดินทาง", "ป้ายจราจร", "อื่น ๆ"
+]
+OTHER_CATEGORY = "อื่น ๆ"
+
+# raw type string -> category; distinct type strings are few, so this stays small
+_category_memo = {}
+
+# sidebar "ระยะเวลา" option -> timestamp component used as the chart bucket
+TIME_BUCKETS = {"รายวัน": "hour", "รายเดือน": "day", "รายปี": "month", "ทุกปี": "year"}
+
+
+def x_label_keys(time_option, x_labels):
+    """
+    Bucket value for each chart label, e.g. "13:00" -> 13, "มีนาคม" -> 3.
+    """
+    if time_option == "รายวัน":
+        return [int(x.split(':')[0]) for x in x_labels]
+    if time_option == "รายปี":
+        return list(range(1, len(x_labels) + 1))
+    return [int(x) for x in x_labels]
+
+
+def time_bucket(timestamps, bucket):
+    """
+    Compute the bucket key of every timestamp once ("hour" | "day" | "month" | "year").
+    """
+    return getattr(timestamps.dt, bucket)
+
+
+def count_by_bucket(buckets, states, x_keys, status_cols, weights=None):
+    """
+    Count tickets per (bucket, state) in one groupby.
+    Pass weights for rows that are already aggregated (e.g. a count column).
+    Returns: DataFrame indexed by x_keys with one int column per status
+    """
+    frame = pd.DataFrame({"bucket": np.asarray(buckets), "state": np.asarray(states)})
+    if weights is None:
+        counts = frame.groupby(["bucket", "state"]).size()
+    else:
+        frame["weight"] = np.asarray(weights)
+        counts = frame.groupby(["bucket", "state"])["weight"].sum()
+
+    table = counts.unstack(fill_value=0) if len(counts) else pd.DataFrame()
+    return table.reindex(index=x_keys, columns=list(status_cols), fill_value=0).fillna(0).astype(int)
+
+
+def status_plot_frame(x_labels, counts):
+    """
+    df_plot layout used by the status charts: X plus one column per status.
+    """
+    df_plot = counts.reset_index(drop=True)
+    df_plot.insert(0, "X", list(x_labels))
+    return df_plot
+
+
+def melt_status_plot(df_plot, status_cols, combined=False, cumulative=False, total_label="รวมทั้งหมด"):
+    """
+    Long format for altair: [X, สถานะ, จำนวน].
+    combined sums all statuses into one total_label series ("รวมทุกสถานะ");
+    cumulative turns each series into a running total ("สะสม").
+    """
+    valid_status_cols = [c for c in status_cols if c in df_plot.columns]
+    wide = df_plot[valid_status_cols]
+
+    if combined:
+        wide = pd.DataFrame({total_label: wide.sum(axis=1) if valid_status_cols else 0}, index=df_plot.index)
+
+    if cumulative:
+        wide = wide.cumsum()
+
+    wide = wide.copy()
+    wide.insert(0, "X", df_plot["X"])
+    return wide.melt(id_vars=["X"], var_name="สถานะ", value_name="จำนวน")
+
+
+def classify_type(value):
+    """
+    First category in BASE_CATEGORIES contained in value, else "อื่น ๆ".
+    """
+    if pd.isna(value) or str(value).strip() == "":
+        return OTHER_CATEGORY
+
+    value = str(value)
+    category = _category_memo.get(value)
+    if category is None:
+        category = next((cat for cat in BASE_CATEGORIES if cat.strip() in value), OTHER_CATEGORY)
+        _category_memo[value] = category
+    return category
+
+
+def classify_types(types):
+    """
+    Vectorized classify_type: each distinct type string is classified once
+    and the result is broadcast back through the factorized codes.
+    """
+    codes, uniques = pd.factorize(types)
+    labels = np.array([classify_type(u) for u in uniques] + [OTHER_CATEGORY], dtype=object)
+    # factorize marks missing values with -1, which picks the trailing OTHER_CATEGORY
+    return pd.Series(labels[codes], index=types.index)
+
+
+def filter_tickets(df, districts, categories, states=()):
+    """
+    Apply the sidebar filters: add type_filtered, then keep the selected
+    districts and categories, and the selected states when any are given.
+    """
+    df = df.assign(type_filtered=classify_types(df["type"]))
+    if not districts or not categories:
+        return df.iloc[0:0]
+
+    mask = df["district"].isin(districts) & df["type_filtered"].isin(categories)
+    if states:
+        mask &= df["state"].isin(states)
+    return df[mask]
+
+
+def facet_mask(index, districts, categories, states=()):
+    """
+    Boolean mask of the entries of a (district, type_filtered, state, ...)
+    MultiIndex matching the sidebar filters; same rules as filter_tickets.
+    Compares the few level values, not the entries.
+    """
+    if not districts or not categories:
+        return np.zeros(len(index), dtype=bool)
+
+    def level_in(name, values):
+        level = index.names.index(name)
+        # code -1 (a missing key) picks the trailing False
+        return np.append(index.levels[level].isin(values), False)[index.codes[level]]
+
+    mask = level_in("district", districts) & level_in("type_filtered", categories)
+    if states:
+        mask &= level_in("state", states)
+    return mask
+
+
+class TicketCube:
+    """
+    Running ticket totals per (district, type_filtered, state) over streamed
+    chunks. The cube does not depend on the sidebar selection: one cube per
+    window answers every selection by slicing its few thousand rows. Sums
+    (not means) are kept so add(chunk, sign=-1) can remove rows again.
+    """
+
+    KEY = ["district", "type_filtered", "state"]
+
+    def __init__(self, finished_state="เสร็จสิ้น"):
+        self.finished_state = finished_state
+        self.table = pd.DataFrame(columns=["total", "duration_sum", "duration_n"], dtype="float64")
+
+    def add(self, frame, sign=1):
+        if frame.empty:
+            return
+        duration = pd.to_numeric(frame["duration_minutes_finished"], errors="coerce")
+        positive = duration > 0
+        chunk = pd.DataFrame({
+            **{name: frame[name].astype(object).to_numpy() for name in self.KEY},
+            "total": 1,
+            "duration_sum": duration.where(positive, 0).to_numpy(),
+            "duration_n": positive.to_numpy(dtype=int),
+        }).groupby(self.KEY, dropna=False).sum() * sign
+        if not self.table.empty:
+            chunk = pd.concat([self.table, chunk]).groupby(level=self.KEY, dropna=False).sum()
+        self.table = chunk
+
+    def select(self, districts, categories, states=()):
+        """
+        Returns: the cube rows matching the selection, empty ones dropped
+        """
+        table = self.table
+        if table.empty:
+            return table
+        table = table[table["total"] != 0]
+        return table[facet_mask(table.index, districts, categories, states)]
+
+    def district_summary(self, districts, categories, states=()):
+        """
+        Returns: List of {district, total, finished, avg_duration, completion_rate}
+        """
+        table = self.select(districts, categories, states)
+        if table.empty:
+            return []
+        finished = table["total"].where(table.index.get_level_values("state") == self.finished_state, 0)
+        table = table.assign(finished=finished).groupby(level="district").sum()
+
+        summary = []
+        for district, row in table[table["total"] > 0].iterrows():
+            total = int(row["total"])
+            finished = int(row["finished"])
+            avg_duration = row["duration_sum"] / row["duration_n"] if row["duration_n"] else 0
+            summary.append({
+                "district": district,
+                "total": total,
+                "finished": finished,
+                "avg_duration": float(avg_duration),
+                "completion_rate": round((finished / total) * 100, 2),
+            })
+        return summary
+
+    def type_counts(self, districts, categories, states=()):
+        """
+        Returns: int Series of ticket counts indexed by (district, type_filtered)
+        """
+        table = self.select(districts, categories, states)
+        if table.empty:
+            index = pd.MultiIndex.from_arrays([[], []], names=["district", "type_filtered"])
+            return pd.Series([], index=index, dtype=int)
+        counts = table["total"].groupby(level=["district", "type_filtered"]).sum()
+        return counts[counts != 0].astype(int)
+
+
+# number of set bits in each byte value, for counting rows in packed bitsets
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+class FacetIndex:
+    """
+    One packed bitset (one bit per row) per value of each facet column.
+    A selection is an OR within a facet and an AND across facets, computed
+    over n_rows / 8 bytes instead of comparing strings row by row.
+    """
+
+    __slots__ = ("n_rows", "bitsets")
+
+    def __init__(self, columns):
+        """
+        columns: Dict {facet: pd.Categorical}, all of the same length
+        """
+        self.n_rows = len(next(iter(columns.values()))) if columns else 0
+        self.bitsets = {}
+        for name, values in columns.items():
+            facet = {}
+            for code, value in enumerate(values.categories):
+                bits = np.packbits(values.codes == code)
+                bits.flags.writeable = False
+                facet[value] = bits
+            self.bitsets[name] = facet
+
+    def match(self, selection):
+        """
+        selection: Dict {facet: values}; None for a facet means no filter.
+        Returns: packed bitset of the matching rows
+        """
+        bits = np.packbits(np.ones(self.n_rows, dtype=bool))
+        for name, values in selection.items():
+            if values is None:
+                continue
+            facet = self.bitsets[name]
+            either = np.zeros_like(bits)
+            for value in values:
+                if value in facet:
+                    np.bitwise_or(either, facet[value], out=either)
+            np.bitwise_and(bits, either, out=bits)
+        return bits
+
+    def rows(self, bits):
+        """
+        Returns: int array of the row positions set in bits
+        """
+        return np.flatnonzero(np.unpackbits(bits, count=self.n_rows))
+
+    def counts(self, facet, selection):
+        """
+        Rows per value of facet, under the selection of every other facet.
+        Returns: Dict {value: count}
+        """
+        others = {name: values for name, values in selection.items() if name != facet}
+        bits = self.match(others)
+        return {
+            value: int(_POPCOUNT[np.bitwise_and(bits, facet_bits)].sum())
+            for value, facet_bits in self.bitsets[facet].items()
+        }
+
+
+class TicketStore:
+    """
+    Immutable, column-wise copy of the map tickets, shared by every session
+    and replaced by merge() as new data lands (db_utils.TicketSync). lat/lng/duration are
+    float32, the key columns are categoricals, and the long text columns stay
+    in the database (db_utils.get_ticket, fetched per ticket_id on click).
+    Filters go through a FacetIndex and return row positions; frame(rows)
+    materializes only those rows.
+    """
+
+    __slots__ = ("columns", "n_rows", "facets")
+
+    FLOAT_COLUMNS = ("lat", "lng", "duration_minutes_finished")
+    CATEGORY_COLUMNS = ("type", "type_filtered", "state", "district")
+    FACET_COLUMNS = ("district", "type_filtered", "state")
+
+    def __init__(self, columns):
+        columns = dict(columns)
+        for values in columns.values():
+            if isinstance(values, np.ndarray):
+                values.flags.writeable = False
+        object.__setattr__(self, "columns", columns)
+        object.__setattr__(self, "n_rows", len(columns["ticket_id"]))
+        object.__setattr__(self, "facets", FacetIndex({name: columns[name] for name in self.FACET_COLUMNS}))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("TicketStore is immutable")
+
+    def __len__(self):
+        return self.n_rows
+
+    @classmethod
+    def compact(cls, df):
+        """
+        Store columns of a get_map_data frame; type_filtered is classified here once.
+        Returns: Dict {column: array}
+        """
+        columns = {"ticket_id": df["ticket_id"].to_numpy(dtype=object, copy=True)}
+        for name in cls.FLOAT_COLUMNS:
+            columns[name] = pd.to_numeric(df[name], errors="coerce").to_numpy(dtype=np.float32)
+        type_filtered = classify_types(df["type"])
+        for name in cls.CATEGORY_COLUMNS:
+            values = type_filtered if name == "type_filtered" else df[name]
+            columns[name] = pd.Categorical(values)
+        columns["timestamp"] = pd.DatetimeIndex(df["timestamp"])
+        return columns
+
+    @classmethod
+    def from_frame(cls, df):
+        return cls(cls.compact(df))
+
+    def merge(self, df, limit=None):
+        """
+        New store with df's tickets added, replacing rows with the same
+        ticket_id, and cut back to the limit most recent by timestamp.
+        Returns: (store, delta), delta a Dict of frames for updating aggregates:
+            old:      rows replaced by a newer copy of the same ticket
+            new:      df's rows
+            dropped:  rows (old or new) cut from the window by limit
+            complete: False when a ticket missing from a full window is older
+                      than the window, so it may be an older ticket that changed
+                      and whose previous copy is not known here
+        """
+        if df.empty:
+            empty = self.frame(np.empty(0, dtype=np.intp))
+            return self, {"old": empty, "new": empty, "dropped": empty, "complete": True}
+
+        current = self.frame()
+        new = pd.DataFrame(self.compact(df))
+        replaced = np.isin(current["ticket_id"].to_numpy(), new["ticket_id"].to_numpy())
+
+        complete = True
+        if limit is not None and len(current) >= limit:
+            unknown = ~np.isin(new["ticket_id"].to_numpy(), current["ticket_id"].to_numpy())
+            complete = not (unknown & (new["timestamp"] <= current["timestamp"].min()).to_numpy()).any()
+
+        merged = pd.concat([current[~replaced], new], ignore_index=True)
+        dropped = merged.iloc[0:0]
+        if limit is not None and len(merged) > limit:
+            merged = merged.sort_values("timestamp", ascending=False, kind="stable")
+            dropped = merged.iloc[limit:]
+            merged = merged.iloc[:limit]
+
+        delta = {"old": current[replaced], "new": new, "dropped": dropped, "complete": complete}
+        return self.from_frame(merged), delta
+
+    def select(self, districts, categories, states=()):
+        """
+        Same rules as filter_tickets.
+        Returns: int array of row positions
+        """
+        if not districts or not categories:
+            return np.empty(0, dtype=np.intp)
+        return self.facets.rows(self.facets.match({
+            "district": districts,
+            "type_filtered": categories,
+            "state": states or None,
+        }))
+
+    def facet_counts(self, facet, districts=None, categories=None, states=None):
+        """
+        Tickets per value of facet ("district" | "type_filtered" | "state")
+        under the other facets' selection; an empty selection is no filter.
+        Returns: Dict {value: count}
+        """
+        return self.facets.counts(facet, {
+            "district": districts or None,
+            "type_filtered": categories or None,
+            "state": states or None,
+        })
+
+    def frame(self, rows=None, columns=None):
+        """
+        DataFrame of the given row positions (all rows when None) and columns.
+        """
+        names = list(columns) if columns is not None else list(self.columns)
+        if rows is None:
+            return pd.DataFrame({name: self.columns[name] for name in names}, copy=False)
+        return pd.DataFrame({name: self.columns[name][rows] for name in names})